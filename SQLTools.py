@@ -4,6 +4,7 @@ import sys
 import os
 import re
 import logging
+import threading
 from collections import OrderedDict
 
 import sublime
@@ -11,17 +12,27 @@ from sublime_plugin import WindowCommand, EventListener, TextCommand
 from Default.paragraph import expand_to_paragraph
 
 from .SQLToolsAPI import Utils
-from .SQLToolsAPI.Storage import Storage, Settings
+from .SQLToolsAPI import ParseUtils
+from .SQLToolsAPI.Storage import Storage, Settings, MetadataCache
 from .SQLToolsAPI.Connection import Connection
 from .SQLToolsAPI.History import History
-from .SQLToolsAPI.Completion import Completion
+from .SQLToolsAPI.Completion import Completion, CompletionWorker
+from .SQLToolsAPI import Session
+from .SQLToolsAPI import Command
+from .SQLToolsAPI import Stats
+from .SQLToolsAPI.Pager import Pager
 
 MESSAGE_RUNNING_CMD = 'Executing SQL command...'
+STATUS_RUNNING_KEY = 'sqltools_running'
 SYNTAX_PLAIN_TEXT = 'Packages/Text/Plain text.tmLanguage'
 SYNTAX_SQL = 'Packages/SQL/SQL.tmLanguage'
 SQLTOOLS_SETTINGS_FILE = 'SQLTools.sublime-settings'
 SQLTOOLS_CONNECTIONS_FILE = 'SQLToolsConnections.sublime-settings'
 SQLTOOLS_QUERIES_FILE = 'SQLToolsSavedQueries.sublime-settings'
+# max number of output chunks waiting to be rendered in the panel
+OUTPUT_MAX_PENDING = 4
+# plugins are loaded in the main thread
+MAIN_THREAD = threading.current_thread()
 
 USER_FOLDER                  = None
 DEFAULT_FOLDER               = None
@@ -35,6 +46,10 @@ settingsStore                = None
 queriesStore                 = None
 connectionsStore             = None
 historyStore                 = None
+metadataCache                = None
+completionWorker             = None
+# paged outputs, by id of the view (panel) they are shown in
+resultPagers                 = {}
 
 # create pluggin logger
 DEFAULT_LOG_LEVEL = logging.WARNING
@@ -59,7 +74,8 @@ def startPlugin():
     global SETTINGS_FILENAME, SETTINGS_FILENAME_DEFAULT
     global CONNECTIONS_FILENAME, CONNECTIONS_FILENAME_DEFAULT
     global QUERIES_FILENAME, QUERIES_FILENAME_DEFAULT
-    global settingsStore, queriesStore, connectionsStore, historyStore
+    global settingsStore, queriesStore, connectionsStore, historyStore, metadataCache
+    global completionWorker
 
     USER_FOLDER = getSublimeUserFolder()
     DEFAULT_FOLDER = os.path.dirname(__file__)
@@ -87,6 +103,7 @@ def startPlugin():
 
     queriesStore = Storage(QUERIES_FILENAME, default=QUERIES_FILENAME_DEFAULT)
     historyStore = History(settingsStore.get('history_size', 100))
+    metadataCache = MetadataCache(os.path.join(sublime.cache_path(), __package__))
 
     if settingsStore.get('debug', False):
         plugin_logger.setLevel(logging.DEBUG)
@@ -94,8 +111,15 @@ def startPlugin():
         plugin_logger.setLevel(DEFAULT_LOG_LEVEL)
 
     Connection.setTimeout(settingsStore.get('thread_timeout', 15))
+    Command.configureExecutor(settingsStore.get('max_worker_threads', 8),
+                              settingsStore.get('max_queries_per_connection', 3))
+    Command.setInFlightListener(lambda: sublime.set_timeout(updateRunningStatus, 0))
     Connection.setHistoryManager(historyStore)
 
+    if completionWorker is not None:
+        completionWorker.stop()
+    completionWorker = CompletionWorker(settingsStore.get('autocomplete_delay', 20) / 1000)
+
     logger.info('plugin (re)loaded')
     logger.info('version %s', __version__)
 
@@ -139,22 +163,119 @@ def createOutput(panel=None, syntax=None, prependText=None):
         panel.run_command('append', {'characters': str(prependText)})
 
     initial = True
+    # long output is shown by pages, once it has more lines than a page
+    pageSize = settingsStore.get('result_page_size', 0)
+    pager = Pager(pageSize) if pageSize else None
+    pages = {'pager': pager, 'outputStart': 0, 'footerStart': 0}
+
+    # output is rendered in main thread, if it falls behind by more than
+    # OUTPUT_MAX_PENDING chunks, the thread producing output has to wait
+    pending = []
+    pendingLock = threading.Lock()
+    pendingSlots = threading.Semaphore(OUTPUT_MAX_PENDING)
+
+    def render():
+        nonlocal initial, pending
+        with pendingLock:
+            chunks = pending
+            pending = []
+
+        if not chunks:
+            return
 
-    def append(outputContent):
-        nonlocal initial
+        timing = Stats.Timing('render', '{0} chunks'.format(len(chunks)))
         if initial:
             initial = False
             if onInitialOutput:
                 onInitialOutput()
+            # only the latest output of the panel can be paged
+            resultPagers.pop(panel.id(), None)
+            pages['outputStart'] = panel.size()
+
+        text = ''.join(text for text, _ in chunks)
+        if pager is not None:
+            wasPaged = pager.isPaged()
+            onLastPage = pager.page == pager.pageCount() - 1
+            pager.append(text)
+
+        if pager is not None and pager.isPaged():
+            if not wasPaged:
+                resultPagers[panel.id()] = pages
+                renderResultPage(panel, pages)
+            elif onLastPage:
+                renderResultPage(panel, pages)
+            else:
+                renderResultFooter(panel, pages)
+        else:
+            # append all pending content at once
+            panel.set_read_only(False)
+            panel.run_command('append', {'characters': text})
+            panel.set_read_only(True)
 
-        # append content
-        panel.set_read_only(False)
-        panel.run_command('append', {'characters': outputContent})
-        panel.set_read_only(True)
+        timing.mark('render')
+        timing.finish()
+
+        for _, hasSlot in chunks:
+            if hasSlot:
+                pendingSlots.release()
+
+    def append(outputContent):
+        # main thread renders right away (waiting for a slot would never end)
+        if threading.current_thread() is MAIN_THREAD:
+            with pendingLock:
+                pending.append((outputContent, False))
+            render()
+            return
+
+        pendingSlots.acquire()
+        with pendingLock:
+            pending.append((outputContent, True))
+        sublime.set_timeout(render, 0)
 
     return append
 
 
+def resultPageFooter(pager):
+    first, last = pager.pageLines()
+    return ('\n-- Page {0} of {1}, lines {2}-{3} of {4} '
+            '(ST: Next Result Page, ST: Previous Result Page) --\n').format(
+        pager.page + 1, pager.pageCount(), first, last, pager.lineCount())
+
+
+def renderResultPage(panel, pages):
+    # only the current page is in the panel, whatever the size of the output
+    pager = pages['pager']
+    panel.set_read_only(False)
+    panel.run_command('st_replace_output', {'characters': pager.getPage(),
+                                            'begin': pages['outputStart']})
+    pages['footerStart'] = panel.size()
+    panel.run_command('append', {'characters': resultPageFooter(pager)})
+    panel.set_read_only(True)
+
+
+def renderResultFooter(panel, pages):
+    panel.set_read_only(False)
+    panel.run_command('st_replace_output', {'characters': resultPageFooter(pages['pager']),
+                                            'begin': pages['footerStart']})
+    panel.set_read_only(True)
+
+
+def showResultPage(step):
+    window = Window()
+    views = [window.find_output_panel('SQLTools Result')] + window.views()
+    for view in views:
+        if view is not None and view.id() in resultPagers:
+            pages = resultPagers[view.id()]
+            pager = pages['pager']
+            page = pager.page
+            if pager.setPage(page + step) != page:
+                renderResultPage(view, pages)
+                view.show(pages['outputStart'])
+            return
+
+    window.status_message('{0}: No paged result'.format(__package__))
+
+
 def toNewTab(content, name="", suffix="SQLTools Saved Query"):
     resultContainer = Window().new_file()
     resultContainer.set_name(
@@ -341,6 +462,10 @@ class ST(EventListener):
             return merged
 
         def createConnection(connectionName, config, settings, callback=None):
+            # release the DB CLI processes kept by previous connection
+            if ST.conn:
+                ST.conn.closeSessions()
+
             # if DB cli binary could not be found in path a FileNotFoundError is thrown
             try:
                 ST.conn = Connection(connectionName, config, settings=settings)
@@ -382,51 +507,135 @@ class ST(EventListener):
         promptNext()
 
     @staticmethod
-    def loadConnectionData(callback=None):
-        # clear the list of identifiers (in case connection is changed)
-        ST.tables = []
-        ST.columns = []
-        ST.functions = []
-        ST.completion = None
-        objectsLoaded = 0
+    def loadConnectionData(callback=None, refresh=False):
+        # clear the list of identifiers (in case connection is changed),
+        # on refresh the current ones are served until the new ones are loaded
+        if not refresh:
+            ST.tables = []
+            ST.columns = []
+            ST.functions = []
+            ST.completion = None
+
+        # statements typed for previous connection are not needed anymore,
+        # and the cache stats (ST: Show Stats) start over for this connection
+        ParseUtils.extractTablesCacheClear()
 
         if not ST.conn:
             return
 
+        conn = ST.conn
+        fingerprint = '{0} {1}'.format(conn.type, conn.info())
+        useCache = metadataCache is not None and settingsStore.get('cache_connection_data', True)
+        tables = []
+        columns = []
+        functions = []
+        foreignKeys = []
+        # some of the objects could not be loaded (query timed out)
+        loadFailed = False
+        freshDataLoaded = False
+        callbackCalled = False
+
+        # runs in main thread, so identifiers and completions are replaced at once
+        def swapData(tables, columns, functions, completion, fresh, onlyIfEmpty):
+            nonlocal freshDataLoaded, callbackCalled
+            # connection was changed or fresh objects are already served
+            if ST.conn is not conn or freshDataLoaded:
+                return
+
+            # objects which may be incomplete do not replace the served ones
+            if onlyIfEmpty and ST.tables:
+                logger.info('keeping the objects of "%s" which are already served', conn.name)
+            else:
+                freshDataLoaded = fresh
+                ST.tables = tables
+                ST.columns = columns
+                ST.functions = functions
+                ST.completion = completion
+
+            if callback and not callbackCalled:
+                callbackCalled = True
+                callback()
+
+        def serveData(tables, columns, functions, foreignKeys, fresh, onlyIfEmpty=False):
+            completion = Completion(tables, columns, functions, settings=settingsStore,
+                                    foreignKeys=foreignKeys)
+            sublime.set_timeout(lambda: swapData(tables, columns, functions, completion,
+                                                 fresh, onlyIfEmpty), 0)
+
+        def loadCachedData():
+            cached = metadataCache.get(conn.name, fingerprint)
+            if cached:
+                logger.info('serving cached objects of "%s"', conn.name)
+                serveData(cached['tables'], cached['columns'], cached['functions'],
+                          cached.get('foreign_keys', []), fresh=False)
+
+        def isComplete():
+            if loadFailed:
+                logger.info('loading of objects of "%s" failed', conn.name)
+                return False
+            # errors of internal queries are silenced, so a failed connection
+            # looks like an empty database
+            if not tables:
+                logger.info('no tables of "%s" loaded', conn.name)
+                return False
+            return True
+
         def afterAllDataHasLoaded():
-            ST.completion = Completion(ST.tables, ST.columns, ST.functions, settings=settingsStore)
+            # incomplete objects are served only if there are no others (cached
+            # or loaded before refresh), and they are never cached
+            complete = isComplete()
+            serveData(tables, columns, functions, foreignKeys, fresh=complete,
+                      onlyIfEmpty=not complete)
             logger.info('completions loaded')
-            if (callback):
-                callback()
+            if useCache and complete:
+                metadataCache.set(conn.name, fingerprint, tables, columns, functions, foreignKeys)
 
-        def tablesCallback(tables):
-            ST.tables = tables
-            nonlocal objectsLoaded
-            objectsLoaded += 1
+        def tablesCallback(result):
+            nonlocal tables, loadFailed
+            if result is None:
+                loadFailed = True
+                return
+            tables = result
             logger.info('loaded tables : "{0}"'.format(tables))
-            if objectsLoaded == 3:
-                afterAllDataHasLoaded()
 
-        def columnsCallback(columns):
-            ST.columns = columns
-            nonlocal objectsLoaded
-            objectsLoaded += 1
+        def columnsCallback(result):
+            nonlocal columns, loadFailed
+            if result is None:
+                loadFailed = True
+                return
+            columns = result
             logger.info('loaded columns : "{0}"'.format(columns))
-            if objectsLoaded == 3:
-                afterAllDataHasLoaded()
 
-        def functionsCallback(functions):
-            ST.functions = functions
-            nonlocal objectsLoaded
-            objectsLoaded += 1
+        def functionsCallback(result):
+            nonlocal functions, loadFailed
+            if result is None:
+                loadFailed = True
+                return
+            functions = result
             logger.info('loaded functions: "{0}"'.format(functions))
-            if objectsLoaded == 3:
-                logger.info('all objects loaded')
-                afterAllDataHasLoaded()
 
-        ST.conn.getTables(tablesCallback)
-        ST.conn.getColumns(columnsCallback)
-        ST.conn.getFunctions(functionsCallback)
+        def foreignKeysCallback(result):
+            nonlocal foreignKeys, loadFailed
+            if result is None:
+                loadFailed = True
+                return
+            foreignKeys = result
+            logger.info('loaded foreign keys: "{0}"'.format(foreignKeys))
+
+        def allObjectsLoaded():
+            logger.info('all objects loaded')
+            afterAllDataHasLoaded()
+
+        # serve cached objects right away (unless refreshing), while the
+        # fresh ones are loaded from the database in background
+        if useCache and not refresh:
+            sublime.set_timeout_async(loadCachedData, 0)
+
+        Command.whenAllDone([ST.conn.getTables(tablesCallback),
+                             ST.conn.getColumns(columnsCallback),
+                             ST.conn.getFunctions(functionsCallback),
+                             ST.conn.getForeignKeys(foreignKeysCallback)],
+                            allObjectsLoaded)
 
     @staticmethod
     def selectConnectionQuickPanel(callback=None):
@@ -502,6 +711,11 @@ class ST(EventListener):
         w.run_command('insert', {'characters': initialText})
         w.run_command("select_all")
 
+    @staticmethod
+    def on_close(view):
+        # the output of closed view is not needed anymore
+        resultPagers.pop(view.id(), None)
+
     @staticmethod
     def on_query_completions(view, prefix, locations):
         # skip completions, if no connection
@@ -531,6 +745,49 @@ class ST(EventListener):
             else:
                 return None
 
+        # completions are computed in background, the request is identified
+        # by the state of the view, so stale requests can be dropped
+        key = (view.id(), view.change_count(), locations[0])
+        completion = ST.completion
+        worker = completionWorker
+
+        def compute():
+            if not worker.isLatest(key) or view.change_count() != key[1]:
+                return None
+            return ST.getCompletions(view, prefix, locations[0], completion)
+
+        # sublime text 4: completions are provided once they are computed
+        if hasattr(sublime, 'CompletionList'):
+            completionList = sublime.CompletionList()
+
+            def setCompletions(result):
+                completions = ST.toSublimeCompletions(result)
+                if completions is None:
+                    completionList.set_completions([])
+                elif isinstance(completions, tuple):
+                    completionList.set_completions(*completions)
+                else:
+                    completionList.set_completions(completions)
+
+            worker.submit(key, compute, setCompletions)
+            return completionList
+
+        # sublime text 3: serve the computed result, when it is ready the
+        # completions are requested again (for the same state of the view)
+        computed, result = worker.result(key)
+        if computed:
+            return ST.toSublimeCompletions(result)
+
+        def showCompletions(result):
+            if ST.toSublimeCompletions(result) is None:
+                return
+            sublime.set_timeout(lambda: ST.showComputedCompletions(view, key), 0)
+
+        worker.submit(key, compute, showCompletions)
+        return None
+
+    @staticmethod
+    def getCompletions(view, prefix, currentPoint, completion):
         # sublimePrefix = prefix
         # sublimeCompletions = view.extract_completions(sublimePrefix, locations[0])
 
@@ -542,7 +799,6 @@ class ST(EventListener):
 
         # get a Region that starts at the beginning of current line
         # and ends at current cursor position
-        currentPoint = locations[0]
         lineStartPoint = view.line(currentPoint).begin()
         lineStartToLocation = sublime.Region(lineStartPoint, currentPoint)
         try:
@@ -558,7 +814,13 @@ class ST(EventListener):
         sqlToCursor = view.substr(sqlToCursorRegion)
 
         # get completions
-        autoCompleteList, inhibit = ST.completion.getAutoCompleteList(prefix, sql, sqlToCursor)
+        return completion.getAutoCompleteList(prefix, sql, sqlToCursor)
+
+    @staticmethod
+    def toSublimeCompletions(result):
+        if not result:
+            return None
+        autoCompleteList, inhibit = result
 
         # safe check here, so even if we return empty completions and inhibit is true
         # we return empty completions to show default sublime completions
@@ -570,6 +832,17 @@ class ST(EventListener):
 
         return autoCompleteList
 
+    @staticmethod
+    def showComputedCompletions(view, key):
+        # the view has changed since, newer request is on the way
+        if view.change_count() != key[1] or not completionWorker.result(key)[0]:
+            return
+        view.run_command('hide_auto_complete')
+        view.run_command('auto_complete', {
+            'disable_auto_insert': True,
+            'next_completion_if_showing': False
+        })
+
 
 # #
 # # Commands
@@ -604,7 +877,8 @@ class StShowRecords(WindowCommand):
             prependText = 'Table "{tableName}"\n'.format(tableName=tableName)
             return ST.conn.getTableRecords(
                 tableName,
-                createOutput(prependText=prependText))
+                createOutput(prependText=prependText),
+                owner=Window().id())
 
         ST.showTablesQuickPanel(callback=onTableSelected)
 
@@ -622,7 +896,8 @@ class StDescTable(WindowCommand):
             if index < 0:
                 return None
             Window().status_message(MESSAGE_RUNNING_CMD)
-            return ST.conn.getTableDescription(ST.tables[index], createOutput(syntax=currentSyntax))
+            return ST.conn.getTableDescription(ST.tables[index], createOutput(syntax=currentSyntax),
+                                              owner=Window().id())
 
         ST.showTablesQuickPanel(callback=onTableSelected)
 
@@ -641,7 +916,8 @@ class StDescFunction(WindowCommand):
                 return None
             Window().status_message(MESSAGE_RUNNING_CMD)
             functionName = ST.functions[index].split('(', 1)[0]
-            return ST.conn.getFunctionDescription(functionName, createOutput(syntax=currentSyntax))
+            return ST.conn.getFunctionDescription(functionName, createOutput(syntax=currentSyntax),
+                                                 owner=Window().id())
 
         # get everything until first occurrence of "(", e.g. get "function_name"
         # from "function_name(int)"
@@ -653,7 +929,7 @@ class StRefreshConnectionData(WindowCommand):
     def run():
         if not ST.conn:
             return
-        ST.loadConnectionData()
+        ST.loadConnectionData(refresh=True)
 
 
 class StExplainPlan(WindowCommand):
@@ -664,7 +940,7 @@ class StExplainPlan(WindowCommand):
             return
 
         Window().status_message(MESSAGE_RUNNING_CMD)
-        ST.conn.explainPlan(getSelectionText(), createOutput())
+        ST.conn.explainPlan(getSelectionText(), createOutput(), owner=Window().id())
 
 
 class StExecute(WindowCommand):
@@ -675,7 +951,7 @@ class StExecute(WindowCommand):
             return
 
         Window().status_message(MESSAGE_RUNNING_CMD)
-        ST.conn.execute(getSelectionText(), createOutput())
+        ST.conn.execute(getSelectionText(), createOutput(), owner=Window().id())
 
 
 class StExecuteAll(WindowCommand):
@@ -687,7 +963,19 @@ class StExecuteAll(WindowCommand):
 
         Window().status_message(MESSAGE_RUNNING_CMD)
         allText = View().substr(sublime.Region(0, View().size()))
-        ST.conn.execute(allText, createOutput())
+        ST.conn.execute(allText, createOutput(), owner=Window().id())
+
+
+class StCancelQuery(WindowCommand):
+    @staticmethod
+    def run():
+        connection = ST.conn.name if ST.conn else None
+        cancelled = Command.cancelCommands(owner=Window().id(), connection=connection)
+        if not cancelled:
+            Window().status_message('{0}: No running queries'.format(__package__))
+            return
+
+        Window().status_message('{0}: Cancelled {1} queries'.format(__package__, cancelled))
 
 
 class StFormat(TextCommand):
@@ -711,6 +999,45 @@ class StFormatAll(TextCommand):
         View().replace(edit, region, Utils.formatSql(textToFormat, settingsStore.get('format', {})))
 
 
+class StOpenResultFile(WindowCommand):
+    @staticmethod
+    def run():
+        resultFile = Command.lastResultFile()
+        if not resultFile or not os.path.isfile(resultFile):
+            sublime.message_dialog('There is no saved result file.')
+            return
+
+        Window().open_file(resultFile)
+
+
+class StNextResultPage(WindowCommand):
+    @staticmethod
+    def run():
+        showResultPage(1)
+
+
+class StPrevResultPage(WindowCommand):
+    @staticmethod
+    def run():
+        showResultPage(-1)
+
+
+class StReplaceOutput(TextCommand):
+    def run(self, edit, characters, begin=0):
+        self.view.replace(edit, sublime.Region(begin, self.view.size()), characters)
+
+
+class StShowStats(WindowCommand):
+    @staticmethod
+    def run():
+        panel = Window().create_output_panel('SQLTools Stats')
+        panel.set_read_only(False)
+        caches = {'extract tables': ParseUtils.extractTablesCacheInfo()}
+        panel.run_command('append', {'characters': Stats.formatStats(caches=caches)})
+        panel.set_read_only(True)
+        Window().run_command('show_panel', {'panel': 'output.SQLTools Stats'})
+
+
 class StVersion(WindowCommand):
     @staticmethod
     def run():
@@ -731,7 +1058,7 @@ class StHistory(WindowCommand):
         def cb(index):
             if index < 0:
                 return None
-            return ST.conn.execute(historyStore.get(index), createOutput())
+            return ST.conn.execute(historyStore.get(index), createOutput(), owner=Window().id())
 
         Window().show_quick_panel(historyStore.all(), cb)
 
@@ -770,7 +1097,7 @@ class StListQueries(WindowCommand):
 
             alias, query = options[index]
             if mode == "run":
-                ST.conn.execute(query, createOutput())
+                ST.conn.execute(query, createOutput(), owner=Window().id())
             elif mode == "insert":
                 insertContent(query)
             else:
@@ -816,6 +1143,16 @@ def Window():
     return sublime.active_window()
 
 
+def updateRunningStatus():
+    for window in sublime.windows():
+        running = len(Command.inFlightCommands(owner=window.id()))
+        for view in window.views():
+            if running:
+                view.set_status(STATUS_RUNNING_KEY, 'ST: {0} running'.format(running))
+            else:
+                view.erase_status(STATUS_RUNNING_KEY)
+
+
 def View():
     return Window().active_view()
 
@@ -826,10 +1163,14 @@ def reload():
         import imp
         imp.reload(sys.modules[__package__ + ".SQLToolsAPI"])
         imp.reload(sys.modules[__package__ + ".SQLToolsAPI.Utils"])
+        imp.reload(sys.modules[__package__ + ".SQLToolsAPI.Stats"])
         imp.reload(sys.modules[__package__ + ".SQLToolsAPI.Completion"])
         imp.reload(sys.modules[__package__ + ".SQLToolsAPI.Storage"])
         imp.reload(sys.modules[__package__ + ".SQLToolsAPI.History"])
         imp.reload(sys.modules[__package__ + ".SQLToolsAPI.Command"])
+        imp.reload(sys.modules[__package__ + ".SQLToolsAPI.Session"])
+        imp.reload(sys.modules[__package__ + ".SQLToolsAPI.ResultSet"])
+        imp.reload(sys.modules[__package__ + ".SQLToolsAPI.Pager"])
         imp.reload(sys.modules[__package__ + ".SQLToolsAPI.Connection"])
     except Exception as e:
         raise (e)
@@ -863,5 +1204,9 @@ def plugin_loaded():
 
 
 def plugin_unloaded():
+    Session.closeAllPools()
+    Command.removeResultFiles()
+    resultPagers.clear()
+
     if plugin_logger.handlers:
         plugin_logger.handlers.pop()
@@ -1,18 +1,401 @@
 import os
 import signal
 import subprocess
+import tempfile
 import time
+import heapq
 import logging
+import itertools
 
-from threading import Thread, Timer
+from collections import deque
+from concurrent.futures import Future
+from threading import Thread, Event, Lock, Condition
+
+from . import Stats
 
 logger = logging.getLogger(__name__)
 
+# size of the beginning and the end of too large output shown in the panel
+RESULT_PREVIEW_SIZE = 64 * 1024
+RESULT_READ_SIZE = 64 * 1024
+
+# beginning of the output passed to the callback when the command times out
+TIMEOUT_MESSAGE = "Command execution time exceeded 'thread_timeout'"
+
+# files with the outputs that were too large to be shown
+resultFiles = []
+
+
+def lastResultFile():
+    return resultFiles[-1] if resultFiles else None
+
+
+def removeResultFiles():
+    while resultFiles:
+        try:
+            os.remove(resultFiles.pop())
+        except OSError:
+            pass
+
+
+class Executor(object):
+    """Runs submitted functions in a bounded number of worker threads.
+
+    Functions are submitted with a key (connection name) and at most
+    `perKeyLimit` functions with the same key run at the same time, the rest
+    wait in the queue (in order of submission) without occupying a worker.
+    Worker threads are started on demand, up to `workers` of them.
+    """
+
+    def __init__(self, workers=8, perKeyLimit=3):
+        self.workers = workers
+        self.perKeyLimit = perKeyLimit
+        self.queue = deque()
+        self.running = {}
+        self.threads = 0
+        self.idle = 0
+        self.condition = Condition()
+
+    def configure(self, workers=None, perKeyLimit=None):
+        with self.condition:
+            if workers:
+                self.workers = workers
+            if perKeyLimit:
+                self.perKeyLimit = perKeyLimit
+            # excess workers exit once they are done with current function
+            self.condition.notify_all()
+
+    def submit(self, key, fn, *args):
+        future = Future()
+        with self.condition:
+            self.queue.append((key, fn, args, future))
+            # idle workers are counted as idle until they take the lock again,
+            # so each of them can take only one of the queued functions
+            if len(self.queue) > self.idle and self.threads < self.workers:
+                self.threads += 1
+                worker = Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+            self.condition.notify()
+        return future
+
+    def _next(self):
+        # first queued function whose key has not reached the limit
+        for index, task in enumerate(self.queue):
+            if self.running.get(task[0], 0) < self.perKeyLimit:
+                del self.queue[index]
+                return task
+        return None
+
+    def _work(self):
+        while True:
+            with self.condition:
+                task = None
+                while task is None:
+                    if self.threads > self.workers:
+                        self.threads -= 1
+                        return
+                    task = self._next()
+                    if task is None:
+                        self.idle += 1
+                        self.condition.wait()
+                        self.idle -= 1
+                key, fn, args, future = task
+                self.running[key] = self.running.get(key, 0) + 1
+
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    logger.exception('command failed')
+                    future.set_exception(e)
+
+            with self.condition:
+                self.running[key] -= 1
+                if not self.running[key]:
+                    del self.running[key]
+                # a function waiting for this key can run now
+                self.condition.notify_all()
+
+
+# shared by all commands which run in background
+executor = Executor()
+
+
+def configureExecutor(workers=None, perConnectionLimit=None):
+    executor.configure(workers, perConnectionLimit)
+    logger.info('executor workers: %s, per connection: %s',
+                executor.workers, executor.perKeyLimit)
+
+
+def whenAllDone(futures, callback):
+    """Call callback (without arguments) once all the futures are done."""
+    futures = list(futures)
+    pending = set(futures)
+    lock = Lock()
+
+    def onDone(future):
+        with lock:
+            pending.discard(future)
+            allDone = not pending
+        if allDone:
+            callback()
+
+    for future in futures:
+        future.add_done_callback(onDone)
+
+
+class Watchdog(object):
+    """Single thread which calls functions once their deadline has passed.
+
+    Deadlines are kept in a heap, so the thread only sleeps until the nearest
+    one. Removed deadlines are only marked and dropped from the heap when they
+    get to the top (or when most of the heap consists of them).
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.removed = 0
+        self.counter = itertools.count()
+        self.condition = Condition()
+        self.thread = None
+
+    def add(self, timeout, fn, *args):
+        # entry is a list, so it can be marked as removed in place
+        entry = [time.monotonic() + timeout, next(self.counter), fn, args]
+        with self.condition:
+            heapq.heappush(self.heap, entry)
+            if self.thread is None:
+                self.thread = Thread(target=self._watch)
+                self.thread.daemon = True
+                self.thread.start()
+            # wake up the thread, in case this is the nearest deadline
+            if self.heap[0] is entry:
+                self.condition.notify()
+        return entry
+
+    def remove(self, entry):
+        with self.condition:
+            if entry[2] is None:
+                return
+            entry[2] = None
+            entry[3] = None
+            self.removed += 1
+            if self.removed > 64 and self.removed > len(self.heap) // 2:
+                self.heap = [e for e in self.heap if e[2] is not None]
+                heapq.heapify(self.heap)
+                self.removed = 0
+
+    def __len__(self):
+        with self.condition:
+            return len(self.heap) - self.removed
+
+    def _watch(self):
+        while True:
+            with self.condition:
+                while True:
+                    while self.heap and self.heap[0][2] is None:
+                        heapq.heappop(self.heap)
+                        self.removed -= 1
+                    if not self.heap:
+                        self.condition.wait()
+                        continue
+                    remaining = self.heap[0][0] - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                entry = heapq.heappop(self.heap)
+                fn, args = entry[2], entry[3]
+                entry[2] = None
+                entry[3] = None
+
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception('watchdog function failed')
+
+
+# kills commands which exceed their timeout
+watchdog = Watchdog()
+
+# how long (in seconds) cancelled command has to stop, before it is killed
+CANCEL_GRACE_PERIOD = 3
+
+# commands which are queued or running in background (see ThreadCommand)
+_inFlight = set()
+_inFlightLock = Lock()
+_inFlightListener = None
+
+
+def setInFlightListener(listener):
+    """Set function (without arguments) called when a command is added or removed."""
+    global _inFlightListener
+    _inFlightListener = listener
+
+
+def _notifyInFlightListener():
+    if _inFlightListener is not None:
+        try:
+            _inFlightListener()
+        except Exception:
+            logger.exception('in-flight listener failed')
+
+
+def _registerInFlight(command):
+    with _inFlightLock:
+        _inFlight.add(command)
+    _notifyInFlightListener()
+
+
+def _unregisterInFlight(command):
+    with _inFlightLock:
+        _inFlight.discard(command)
+    _notifyInFlightListener()
+
+
+def isInFlight(command):
+    with _inFlightLock:
+        return command in _inFlight
+
+
+def inFlightCommands(owner=None, connection=None):
+    with _inFlightLock:
+        return [c for c in _inFlight
+                if (owner is None or c.owner == owner) and
+                   (connection is None or c.connection == connection)]
+
+
+def cancelCommands(owner=None, connection=None):
+    """Cancel queued and running commands, returns number of cancelled commands."""
+    commands = inFlightCommands(owner, connection)
+    for command in commands:
+        command.cancel()
+    return len(commands)
+
+
+class LimitedOutput(object):
+    """Collects output (bytes) of the command, once it is larger than
+    `sizeLimit` bytes, it is saved to temporary file and only its beginning
+    and end are kept in memory."""
+
+    def __init__(self, sizeLimit):
+        self.sizeLimit = sizeLimit
+        self.size = 0
+        self.chunks = []
+        self.head = None
+        self.tail = deque()
+        self.tailSize = 0
+        self.resultFile = None
+
+    def isSaved(self):
+        return self.resultFile is not None
+
+    def write(self, chunk):
+        self.size += len(chunk)
+
+        if self.resultFile is None:
+            self.chunks.append(chunk)
+            if self.size > self.sizeLimit:
+                self.resultFile = tempfile.NamedTemporaryFile(prefix='SQLTools-', suffix='.txt',
+                                                              delete=False)
+                head = b''.join(self.chunks)
+                self.resultFile.write(head)
+                self.head = head[:RESULT_PREVIEW_SIZE]
+                self.chunks = None
+        else:
+            self.resultFile.write(chunk)
+
+        self.tail.append(chunk)
+        self.tailSize += len(chunk)
+        while self.tailSize - len(self.tail[0]) >= RESULT_PREVIEW_SIZE:
+            self.tailSize -= len(self.tail.popleft())
+
+    def getText(self, encoding):
+        """Return the whole output, or its beginning and end with the name
+        of the file with the whole output, if it was too large."""
+        if self.resultFile is None:
+            return b''.join(self.chunks).decode(encoding, 'replace').replace('\r', '')
+
+        self.resultFile.close()
+        resultFiles.append(self.resultFile.name)
+        logger.info('output of %s bytes saved to %s', self.size, self.resultFile.name)
+
+        # show only complete lines of the beginning and the end
+        head = self.head[:self.head.rfind(b'\n') + 1]
+        tail = b''.join(self.tail)[-RESULT_PREVIEW_SIZE:]
+        tail = tail[tail.find(b'\n') + 1:]
+
+        message = ("\n...\n\n"
+                   "-- Output is too large ({0:.1f} MB), only its beginning and end are shown.\n"
+                   "-- Full output was saved to \"{1}\",\n"
+                   "-- use \"ST: Open Last Result File\" to open it.\n\n"
+                   "...\n\n").format(self.size / 1024 / 1024, self.resultFile.name)
+
+        return (head.decode(encoding, 'replace') + message +
+                tail.decode(encoding, 'replace')).replace('\r', '')
+
+
+class OutputBuffer(object):
+    """Collects streamed output and passes it to callback in bigger chunks.
+
+    Collected output is flushed once it is larger than `size` characters or
+    older than `interval` seconds (checked by a helper thread, so the output
+    is not held back when the DB CLI stops printing for a while). Callback is
+    called while holding the lock, so if the callback blocks (UI can not keep
+    up), so does the writer.
+    """
+
+    def __init__(self, callback, interval=0.05, size=64 * 1024):
+        self.callback = callback
+        self.interval = interval
+        self.size = size
+        self.chunks = []
+        self.length = 0
+        self.started = None
+        self.lock = Lock()
+        self.closed = Event()
+        self.flusher = None
+
+    def write(self, text):
+        with self.lock:
+            if not self.chunks:
+                self.started = time.time()
+            self.chunks.append(text)
+            self.length += len(text)
+            if self.length >= self.size or time.time() - self.started >= self.interval:
+                self._flush()
+
+            # under the lock, so concurrent writers start only one flusher
+            if self.flusher is None:
+                self.flusher = Thread(target=self._flushPeriodically)
+                self.flusher.daemon = True
+                self.flusher.start()
+
+    def _flushPeriodically(self):
+        while not self.closed.wait(self.interval):
+            with self.lock:
+                if self.chunks and time.time() - self.started >= self.interval:
+                    self._flush()
+
+    def _flush(self):
+        if self.chunks:
+            text = ''.join(self.chunks)
+            self.chunks = []
+            self.length = 0
+            self.callback(text)
+
+    def close(self):
+        self.closed.set()
+        with self.lock:
+            self._flush()
+
+
 class Command(object):
     timeout = 15
 
     def __init__(self, args, env, callback, query=None, encoding='utf-8',
-                 options=None, timeout=15, silenceErrors=False, stream=False):
+                 options=None, timeout=15, silenceErrors=False, stream=False,
+                 sessionPool=None, connection=None, owner=None):
         if options is None:
             options = {}
 
@@ -25,7 +408,13 @@ class Command(object):
         self.timeout = timeout
         self.silenceErrors = silenceErrors
         self.stream = stream
+        self.sessionPool = sessionPool
+        self.connection = connection
+        self.owner = owner
+        self.cancelled = False
         self.process = None
+        # durations of the phases of the execution
+        self.timing = self.options.get('timing') or Stats.Timing('query', connection or '')
 
         if 'show_query' not in self.options:
             self.options['show_query'] = False
@@ -34,9 +423,17 @@ class Command(object):
                                                    self.options['show_query']) else False
 
     def run(self):
-        if not self.query:
+        if not self.query or self.cancelled:
             return
 
+        # time spent waiting for a worker
+        self.timing.mark('queue')
+        try:
+            self._run()
+        finally:
+            self.timing.finish()
+
+    def _run(self):
         self.args = map(str, self.args)
         si = None
         if os.name == 'nt':
@@ -50,6 +447,9 @@ class Command(object):
         stderrHandle = subprocess.STDOUT
         if self.silenceErrors:
             stderrHandle = subprocess.PIPE
+            # output is read in chunks, make sure unread stderr does not block the process
+            if self.options.get('result_size_limit'):
+                stderrHandle = subprocess.DEVNULL
 
         # set the environment
         modifiedEnvironment = os.environ.copy()
@@ -58,21 +458,38 @@ class Command(object):
 
         queryTimerStart = time.time()
 
+        if self.sessionPool is not None:
+            if self.sessionPool.accepts(self.query):
+                self._runInSession(modifiedEnvironment, queryTimerStart)
+                return
+            # unfinished last statement would swallow the end marker
+            self.query = self.sessionPool.standaloneQuery(self.query)
+
         self.process = subprocess.Popen(self.args,
                                         stdout=subprocess.PIPE,
                                         stderr=stderrHandle,
                                         stdin=subprocess.PIPE,
                                         env=modifiedEnvironment,
                                         startupinfo=si)
+        self.timing.mark('spawn')
+
+        # cancelled while the process was being started
+        if self.cancelled:
+            self.cancel()
 
         if self.stream:
             self.process.stdin.write(self.query.encode(self.encoding))
             self.process.stdin.close()
             hasWritten = False
 
+            output = OutputBuffer(self.callback)
             for line in self.process.stdout:
-                self.callback(line.decode(self.encoding, 'replace').replace('\r', ''))
+                if not hasWritten:
+                    self.timing.mark('first byte')
+                output.write(line.decode(self.encoding, 'replace').replace('\r', ''))
                 hasWritten = True
+            output.close()
+            self.timing.mark('last byte')
 
             queryTimerEnd = time.time()
             # we are done with the output, terminate the process
@@ -85,12 +502,23 @@ class Command(object):
             if self.options['show_query']:
                 formattedQueryInfo = self._formatShowQuery(self.query, queryTimerStart, queryTimerEnd)
                 self.callback(formattedQueryInfo + '\n')
+            self.timing.mark('output')
+
+            return
 
+        # output that could be too large is read in chunks, so it can
+        # be saved to file instead of keeping it all in the memory
+        if self.options.get('result_size_limit'):
+            resultString = self._readWithSizeLimit(self.options['result_size_limit'])
+            queryTimerEnd = time.time()
+            self.callback(self._withShowQuery(resultString, queryTimerStart, queryTimerEnd))
+            self.timing.mark('output')
             return
 
         # regular mode is handled with more reliable Popen.communicate
         # which also terminates the process afterwards
         results, errors = self.process.communicate(input=self.query.encode(self.encoding))
+        self.timing.mark('last byte')
 
         queryTimerEnd = time.time()
 
@@ -106,7 +534,121 @@ class Command(object):
 
         if self.process is None and resultString != '':
             resultString += '\n'
+        self.timing.mark('decode')
+
+        self.callback(self._withShowQuery(resultString, queryTimerStart, queryTimerEnd))
+        self.timing.mark('output')
+
+    def cancel(self):
+        # command which is still queued will not run at all
+        self.cancelled = True
+
+        process = self.process
+        if not process or process.poll() is not None:
+            return
+
+        # interrupt first, so the CLI can cancel the query on the server
+        # (psql and mysql do that on SIGINT), kill it if that is not enough
+        try:
+            if os.name == 'nt':
+                process.terminate()
+            else:
+                process.send_signal(signal.SIGINT)
+            logger.info('command cancelled (pid %s)', process.pid)
+        except Exception:
+            logger.info('command could not be cancelled (pid %s)', process.pid)
+
+        watchdog.add(CANCEL_GRACE_PERIOD, self._killIfRunning, process)
+
+    def _killIfRunning(self, process):
+        # session processes survive the interrupt, but the command is done then
+        if isInFlight(self) and process.poll() is None:
+            try:
+                process.kill()
+                logger.info('cancelled command did not stop, process killed (pid %s)', process.pid)
+            except Exception:
+                pass
+
+    def _readWithSizeLimit(self, sizeLimit):
+        process = self.process
+
+        def writeQuery():
+            try:
+                process.stdin.write(self.query.encode(self.encoding))
+                process.stdin.close()
+            except OSError:
+                pass
+
+        # write in separate thread, so the process does not block on full stdout
+        writer = Thread(target=writeQuery)
+        writer.daemon = True
+        writer.start()
+
+        output = LimitedOutput(sizeLimit)
+        for chunk in iter(lambda: process.stdout.read(RESULT_READ_SIZE), b''):
+            if not output.size:
+                self.timing.mark('first byte')
+            output.write(chunk)
+
+        process.wait()
+        writer.join()
+        self.timing.mark('last byte')
+
+        if self.process is None and output.size > 0 and not output.isSaved():
+            output.write(b'\n')
+        resultString = output.getText(self.encoding)
+        self.timing.mark('decode')
+        return resultString
+
+    def _runInSession(self, env, queryTimerStart):
+        session = self.sessionPool.acquire(self.args, env,
+                                           encoding=self.encoding,
+                                           silenceErrors=self.silenceErrors,
+                                           scope=self.options.get('session_scope'))
+        self.timing.mark('spawn')
+        if self.cancelled:
+            self.sessionPool.release(session)
+            return
+
+        # expose session process, so it can be killed on timeout
+        self.process = session.process
+        try:
+            if self.stream:
+                output = OutputBuffer(self.callback)
+                try:
+                    session.execute(self.query, output.write)
+                finally:
+                    output.close()
+            elif self.options.get('result_size_limit'):
+                # too large output is saved to file, as when run by separate process
+                output = LimitedOutput(self.options['result_size_limit'])
+                session.execute(self.query, output.write, raw=True)
+            else:
+                resultString = session.execute(self.query)
+        finally:
+            # the process is kept alive for the next query, once the query is
+            # finished it is no longer ours to kill
+            self.process = None
+            self.sessionPool.release(session)
+        self.timing.mark('last byte')
+
+        queryTimerEnd = time.time()
+
+        if not self.stream and self.options.get('result_size_limit'):
+            resultString = output.getText(self.encoding)
+            self.timing.mark('decode')
+
+        if self.stream:
+            if self.options['show_query']:
+                formattedQueryInfo = self._formatShowQuery(self.query, queryTimerStart, queryTimerEnd)
+                self.callback(formattedQueryInfo + '\n')
+            self.timing.mark('output')
+            return
+
+        self.callback(self._withShowQuery(resultString, queryTimerStart, queryTimerEnd))
+        self.timing.mark('output')
 
+    def _withShowQuery(self, resultString, queryTimerStart, queryTimerEnd):
         if self.options['show_query']:
             formattedQueryInfo = self._formatShowQuery(self.query, queryTimerStart, queryTimerEnd)
             queryPlacement = self.options['show_query']
@@ -114,8 +656,7 @@ class Command(object):
                 resultString = "{0}\n{1}".format(formattedQueryInfo, resultString)
             elif queryPlacement == 'bottom':
                 resultString = "{0}{1}\n".format(resultString, formattedQueryInfo)
-
-        self.callback(resultString)
+        return resultString
 
     @staticmethod
     def _formatShowQuery(query, queryTimeStart, queryTimeEnd):
@@ -129,7 +670,8 @@ class Command(object):
 
     @staticmethod
     def createAndRun(args, env, callback, query=None, encoding='utf-8',
-                     options=None, timeout=15, silenceErrors=False, stream=False):
+                     options=None, timeout=15, silenceErrors=False, stream=False,
+                     sessionPool=None, connection=None, owner=None):
         if options is None:
             options = {}
         command = Command(args=args,
@@ -140,27 +682,36 @@ class Command(object):
                           options=options,
                           timeout=timeout,
                           silenceErrors=silenceErrors,
-                          stream=stream)
-        command.run()
+                          stream=stream,
+                          sessionPool=sessionPool,
+                          connection=connection,
+                          owner=owner)
+        future = Future()
+        future.set_result(command.run())
+        return future
 
 
-class ThreadCommand(Command, Thread):
-    def __init__(self, args, env, callback, query=None, encoding='utf-8',
-                 options=None, timeout=Command.timeout, silenceErrors=False, stream=False):
-        if options is None:
-            options = {}
+class ThreadCommand(Command):
+    """Command which runs in background, in a worker of the executor."""
+
+    timeoutMessage = None
 
-        Command.__init__(self,
-                         args=args,
-                         env=env,
-                         callback=callback,
-                         query=query,
-                         encoding=encoding,
-                         options=options,
-                         timeout=timeout,
-                         silenceErrors=silenceErrors,
-                         stream=stream)
-        Thread.__init__(self)
+    def runWithTimeout(self):
+        # timeout is counted from the moment the command starts running,
+        # not from the moment it was queued
+        timeStart = time.time()
+        deadline = watchdog.add(self.timeout, self.stop)
+        try:
+            self.run()
+        finally:
+            watchdog.remove(deadline)
+            _unregisterInFlight(self)
+
+        # passed by the worker, callback may block (until the output is
+        # rendered), which the shared watchdog thread must never do
+        if self.timeoutMessage:
+            self.callback(self.timeoutMessage)
+        return time.time() - timeStart
 
     def stop(self):
         if not self.process:
@@ -177,19 +728,19 @@ class ThreadCommand(Command, Thread):
             self.process = None
 
             logger.info("command execution exceeded timeout (%s s), process killed", self.timeout)
-            self.callback(("Command execution time exceeded 'thread_timeout' ({0} s).\n"
-                           "Process killed!\n\n"
-                          ).format(self.timeout))
+            self.timeoutMessage = ("{0} ({1} s).\n"
+                                   "Process killed!\n\n"
+                                  ).format(TIMEOUT_MESSAGE, self.timeout)
         except Exception:
             logger.info("command execution exceeded timeout (%s s), process could not be killed", self.timeout)
-            self.callback(("Command execution time exceeded 'thread_timeout' ({0} s).\n"
-                           "Process could not be killed!\n\n"
-                          ).format(self.timeout))
-            pass
+            self.timeoutMessage = ("{0} ({1} s).\n"
+                                   "Process could not be killed!\n\n"
+                                  ).format(TIMEOUT_MESSAGE, self.timeout)
 
     @staticmethod
     def createAndRun(args, env, callback, query=None, encoding='utf-8',
-                     options=None, timeout=Command.timeout, silenceErrors=False, stream=False):
+                     options=None, timeout=Command.timeout, silenceErrors=False, stream=False,
+                     sessionPool=None, connection=None, owner=None):
         # Don't allow empty dicts or lists as defaults in method signature,
         # cfr http://nedbatchelder.com/blog/200806/pylint.html
         if options is None:
@@ -202,7 +753,101 @@ class ThreadCommand(Command, Thread):
                                 options=options,
                                 timeout=timeout,
                                 silenceErrors=silenceErrors,
-                                stream=stream)
-        command.start()
-        killTimeout = Timer(command.timeout, command.stop)
-        killTimeout.start()
+                                stream=stream,
+                                sessionPool=sessionPool,
+                                connection=connection,
+                                owner=owner)
+        _registerInFlight(command)
+        return executor.submit(connection, command.runWithTimeout)
+
+    @staticmethod
+    def createAndRunParallel(args, env, callback, queries, parallel=2, encoding='utf-8',
+                             options=None, timeout=Command.timeout, silenceErrors=False,
+                             sessionPool=None, connection=None, owner=None):
+        """Run each of the queries by separate command, at most `parallel` at once.
+
+        Outputs are passed to the callback in the order of the queries (each
+        one once it and all the preceding ones are done), with the execution
+        time of the query. Once any of the commands is cancelled, the queries
+        which have not started yet are not run.
+        """
+        if options is None:
+            options = {}
+
+        total = len(queries)
+        outputs = [[] for query in queries]
+        timings = [None] * total
+        pending = iter(range(total))
+        lock = Lock()
+        done = Future()
+        state = {'running': 0, 'written': 0, 'stopped': False}
+
+        # following functions are called with the lock held, so that outputs
+        # are written in order
+        def writeOutput(index):
+            callback('-- Query {0} of {1}, executed in {2:.3f} s\n{3}\n'.format(
+                index + 1, total, timings[index], ''.join(outputs[index])))
+            outputs[index] = None
+
+        def writeFinished():
+            while state['written'] < total and timings[state['written']] is not None:
+                writeOutput(state['written'])
+                state['written'] += 1
+
+        def writeRemaining():
+            cancelled = 0
+            for index in range(state['written'], total):
+                if timings[index] is None:
+                    cancelled += 1
+                else:
+                    writeOutput(index)
+            state['written'] = total
+            if cancelled:
+                callback('-- {0} of {1} queries were cancelled\n'.format(cancelled, total))
+
+        def runNext():
+            with lock:
+                index = None if state['stopped'] else next(pending, None)
+                if index is None:
+                    if not state['running'] and not done.done():
+                        writeRemaining()
+                        done.set_result(None)
+                    return
+                state['running'] += 1
+
+            command = ThreadCommand(args=args,
+                                    env=env,
+                                    callback=outputs[index].append,
+                                    query=queries[index],
+                                    encoding=encoding,
+                                    options=options,
+                                    timeout=timeout,
+                                    silenceErrors=silenceErrors,
+                                    stream=False,
+                                    sessionPool=sessionPool,
+                                    connection=connection,
+                                    owner=owner)
+            _registerInFlight(command)
+            future = executor.submit(connection, command.runWithTimeout)
+            future.add_done_callback(lambda future: onFinished(index, command, future))
+
+        def onFinished(index, command, future):
+            with lock:
+                state['running'] -= 1
+                if command.cancelled:
+                    state['stopped'] = True
+                elif future.exception() is None:
+                    timings[index] = future.result()
+                    writeFinished()
+                else:
+                    outputs[index].append(str(future.exception()))
+                    timings[index] = 0.0
+                    writeFinished()
+            runNext()
+
+        for i in range(min(parallel, total)):
+            runNext()
+
+        if not total:
+            done.set_result(None)
+        return done
@@ -1,12 +1,19 @@
 import re
+import time
 import logging
+from bisect import bisect_left
+from itertools import chain, islice
 from collections import namedtuple
+from threading import Thread, Condition
 
-from .ParseUtils import extractTables
+from .ParseUtils import extractTablesCached
+from . import Stats
 
 JOIN_COND_PATTERN = r"\s+?JOIN\s+?[\w\.`\"]+\s+?(?:AS\s+)?(\w+)\s+?ON\s+?(?:[\w\.]+)?$"
 JOIN_COND_REGEX = re.compile(JOIN_COND_PATTERN, re.IGNORECASE)
 
+IDENT_REGEX = re.compile(r'[`"\w.$]*')
+
 keywords_list = [
     'SELECT', 'UPDATE', 'DELETE', 'INSERT', 'INTO', 'FROM',
     'WHERE', 'GROUP BY', 'ORDER BY', 'HAVING', 'JOIN',
@@ -14,6 +21,15 @@ keywords_list = [
     'LIMIT', 'DISTINCT', 'SET'
 ]
 
+# type of completion item as shown in the completions list
+TYPE_DISPLAY = {
+    'Table': 'Table',
+    'Keyword': 'Keyword',
+    'Alias': 'Alias',
+    'Function': 'Func',
+    'Column': 'Col'
+}
+
 logger = logging.getLogger(__name__)
 
 
@@ -47,13 +63,66 @@ def _escapeDollarSign(ident):
     return ident.replace("$", "\$")
 
 
-class CompletionItem(namedtuple('CompletionItem', ['type', 'ident'])):
+# lower-cased and unquoted name (with parent, if any) used for lookups,
+# e.g. "Schema"."MyTable" --> schema.mytable
+def _lookupName(ident):
+    return '.'.join(_stripQuotes(part) for part in ident.lower().split('.')[-2:])
+
+
+# whether sorted sequence (list or range) contains the value
+def _containsSorted(sequence, value):
+    index = bisect_left(sequence, value)
+    return index < len(sequence) and sequence[index] == value
+
+
+# remove identifier under cursor from sql, so that sql does not change
+# while the identifier is being typed (and parsed sql can be reused)
+def _stripCursorIdent(sql, sqlToCursor, prefix):
+    if not sql.startswith(sqlToCursor):
+        return sql
+
+    cursor = len(sqlToCursor)
+    start = cursor - len(prefix) if sqlToCursor.endswith(prefix) else cursor
+    end = IDENT_REGEX.match(sql, cursor).end()
+    return sql[:start] + sql[end:]
+
+
+# format completion item according to sublime text completions format
+def _formatItem(itemType, ident, stripQuotes=False):
+    typeDisplay = TYPE_DISPLAY.get(itemType)
+    if not typeDisplay:
+        return (ident, _stripQuotesOnDemand(ident, stripQuotes))
+
+    part = ident.split('.')
+    if len(part) > 1:
+        return ("{0}\t({1} {2})".format(part[1], part[0], typeDisplay),
+                _stripQuotesOnDemand(_escapeDollarSign(part[1]), stripQuotes))
+
+    return ("{0}\t({1})".format(ident, typeDisplay),
+            _stripQuotesOnDemand(_escapeDollarSign(ident), stripQuotes))
+
+
+def _formatItemVariants(itemType, ident):
+    formatted = _formatItem(itemType, ident)
+    strippedContents = _stripQuotes(formatted[1])
+    # most identifiers are not quoted, both variants are the same then
+    if strippedContents == formatted[1]:
+        return formatted, formatted
+    return formatted, (formatted[0], strippedContents)
+
+
+class CompletionItem(namedtuple('CompletionItem', ['type', 'ident', 'formatted'])):
     """Represents a potential or actual completion item.
       * type - type of item (Table, Function, Column)
       * ident - identifier (table.column, schema.table, alias)
+      * formatted - completion of the item as (with quotes, without quotes),
+                    it is formatted once, when the item is created
     """
     __slots__ = ()
 
+    def __new__(cls, type, ident):
+        return super().__new__(cls, type, ident, _formatItemVariants(type, ident))
+
     @property
     def parent(self):
         """Parent of identifier, e.g. "table" from "table.column" """
@@ -136,38 +205,184 @@ class CompletionItem(namedtuple('CompletionItem', ['type', 'ident'])):
                 return score
         return 0
 
-    # format completion item according to sublime text completions format
+    # completion item in sublime text completions format
     def format(self, stripQuotes=False):
-        typeDisplay = ''
-        if self.type == 'Table':
-            typeDisplay = self.type
-        elif self.type == 'Keyword':
-            typeDisplay = self.type
-        elif self.type == 'Alias':
-            typeDisplay = self.type
-        elif self.type == 'Function':
-            typeDisplay = 'Func'
-        elif self.type == 'Column':
-            typeDisplay = 'Col'
-
-        if not typeDisplay:
-            return (self.ident, _stripQuotesOnDemand(self.ident, stripQuotes))
-
-        part = self.ident.split('.')
-        if len(part) > 1:
-            return ("{0}\t({1} {2})".format(part[1], part[0], typeDisplay),
-                    _stripQuotesOnDemand(_escapeDollarSign(part[1]), stripQuotes))
-
-        return ("{0}\t({1})".format(self.ident, typeDisplay),
-                _stripQuotesOnDemand(_escapeDollarSign(self.ident), stripQuotes))
+        return self.formatted[1 if stripQuotes else 0]
+
+
+class IdentifierIndex:
+    """Index of completion items for lookups by their lower-cased and unquoted names.
+
+    Names are normalized only once, when the index is built. Method `match`
+    returns the same items (in the same order) as filtering all items with
+    `CompletionItem.prefixMatchScore`, but it only looks at the items that
+    could possibly match, instead of scanning all of them:
+      * parent.name - items are looked up by parent name
+      * n           - single char matches start of the name (binary search)
+      * name        - matches anywhere in the name, candidates are taken from
+                      the trigram of search string that is contained in the
+                      least number of names
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self.itemNames = []  # normalized name of each item
+        self.named = {}      # normalized name -> positions of items
+        self.children = {}  # normalized parent name -> positions of items
+
+        for position, item in enumerate(items):
+            parts = item._matchIdent().split('.')
+            name = _stripQuotes(parts.pop())
+            self.itemNames.append(name)
+            self.named.setdefault(name, []).append(position)
+            if parts:
+                self.children.setdefault(_stripQuotes(parts.pop()), []).append(position)
+
+        self.names = sorted(self.named)
+
+        # trigrams of names (and last two chars of each name) -> names
+        self.ngrams = {}
+        for name in self.names:
+            grams = set(name[i:i + 3] for i in range(len(name) - 2))
+            grams.add(name[-2:])
+            for gram in grams:
+                self.ngrams.setdefault(gram, []).append(name)
+
+        # two chars -> trigrams starting with them
+        self.trigrams = {}
+        for gram in self.ngrams:
+            if len(gram) == 3:
+                self.trigrams.setdefault(gram[:2], []).append(gram)
+
+    def __len__(self):
+        return len(self.items)
+
+    def childrenOf(self, parent):
+        """Return items of given (lower-cased and unquoted) parent."""
+        return [self.items[position] for position in self.children.get(parent, ())]
+
+    def match(self, search, exactly=False, limit=None, preferred=()):
+        """Return matching items, at most `limit` of them (if given).
+
+        If there are more matches than the limit, the `preferred` items are
+        kept first, then the items with name starting with search string.
+        """
+        search = search.lower()
+
+        # match parent exactly and name according to search mode
+        if '.' in search:
+            searchList = search.split('.')
+            searchName = _stripQuotes(searchList.pop())
+            searchParent = _stripQuotes(searchList.pop())
+            positions = [
+                position
+                for position in self.children.get(searchParent, ())
+                if CompletionItem._stringMatched(self.itemNames[position], searchName, exactly)
+            ]
+        else:
+            searchName = _stripQuotes(search)
+            positions = self._matchName(searchName, exactly)
+
+        if limit is not None and len(positions) > limit:
+            positions = self._best(positions, searchName, limit, preferred)
+
+        return [self.items[position] for position in positions]
+
+    def _best(self, positions, search, limit, preferred):
+        itemNames = self.itemNames
+        preferred = sorted(position for position in self._positions(preferred)
+                           if _containsSorted(positions, position))
+        skip = set(preferred)
+
+        # preferred items first, then those with name starting with search
+        # string and the rest, each in the order of index, as positions are
+        # sorted the best ones are taken without ranking all of them
+        starting = (position for position in positions
+                    if position not in skip and itemNames[position].startswith(search))
+        rest = (position for position in positions
+                if position not in skip and not itemNames[position].startswith(search))
+        return list(islice(chain(preferred, starting, rest), limit))
+
+    def _positions(self, items):
+        """Return set of positions of given items in the index."""
+        return set(
+            position
+            for item in items
+            for position in self.named.get(_stripQuotes(item._matchIdent().split('.').pop()), ())
+            if self.items[position] == item
+        )
+
+    def _matchName(self, search, exactly):
+        # empty search string matches anything
+        if search == '':
+            return range(len(self.items))
+
+        if exactly:
+            return self.named.get(search, ())
+
+        if len(search) == 1:
+            names = []
+            index = bisect_left(self.names, search)
+            while index < len(self.names) and self.names[index].startswith(search):
+                names.append(self.names[index])
+                index += 1
+        elif len(search) == 2:
+            # name contains two chars either at the end or at the start of its trigram
+            names = set(self.ngrams.get(search, ()))
+            for gram in self.trigrams.get(search, ()):
+                names.update(self.ngrams[gram])
+        else:
+            candidates = min(
+                (self.ngrams.get(search[i:i + 3], ()) for i in range(len(search) - 2)),
+                key=len)
+            names = [name for name in candidates if search in name]
+
+        if len(names) == 1:
+            return self.named[next(iter(names))]
+
+        positions = [position for name in names for position in self.named[name]]
+        positions.sort()
+        return positions
 
 
 class Completion:
-    def __init__(self, allTables, allColumns, allFunctions, settings=None):
+    def __init__(self, allTables, allColumns, allFunctions, settings=None, foreignKeys=None):
         self.allTables = [CompletionItem('Table', table) for table in allTables]
         self.allColumns = [CompletionItem('Column', column) for column in allColumns]
         self.allFunctions = [CompletionItem('Function', func) for func in allFunctions]
 
+        self.tablesIndex = IdentifierIndex(self.allTables)
+        self.columnsIndex = IdentifierIndex(self.allColumns)
+        self.functionsIndex = IdentifierIndex(self.allFunctions)
+
+        # tables by lookup name, both with and without schema (columns of
+        # each table are in columnsIndex.children)
+        self.tablesByName = {}
+        for table in self.allTables:
+            name = _lookupName(table.ident)
+            self.tablesByName.setdefault(name, []).append(table)
+            if '.' in name:
+                self.tablesByName.setdefault(name.split('.').pop(), []).append(table)
+
+        # id-like columns of tables for join conditions, built on demand
+        self.idColumnsByTable = {}
+
+        # foreign keys (as "table.column=table.column"), by lookup name of
+        # table to (column, referenced table, referenced column), both ways
+        self.foreignKeys = {}
+        for foreignKey in foreignKeys or []:
+            try:
+                source, target = foreignKey.split('=')
+                table, column = source.split('.')
+                refTable, refColumn = target.split('.')
+            except ValueError:
+                logger.debug('Unexpected foreign key: %s', foreignKey)
+                continue
+            table = _stripQuotes(table.lower())
+            refTable = _stripQuotes(refTable.lower())
+            self.foreignKeys.setdefault(table, []).append((column, refTable, refColumn))
+            self.foreignKeys.setdefault(refTable, []).append((refColumn, table, column))
+
         # we don't save the settings (we don't need them after init)
         if settings is None:
             settings = {}
@@ -193,6 +408,9 @@ class Completion:
             if self.completionType not in ['basic', 'smart']:
                 self.completionType = 'smart'
 
+        # maximum number of completions returned, 0 (or null) means no limit
+        self.maxItems = settings.get('autocomplete_max_items', 1000) or None
+
         # determine desired keywords case from settings
         formatSettings = settings.get('format', {})
         keywordCase = formatSettings.get('keyword_case', 'upper')
@@ -207,6 +425,13 @@ class Completion:
 
             self.allKeywords.append(CompletionItem('Keyword', keyword))
 
+    def _tablesNamed(self, name):
+        """Return tables with given name, with or without schema."""
+        return self.tablesByName.get(_lookupName(name), ())
+
+    def _tableColumns(self, tableName):
+        return self.columnsIndex.childrenOf(_stripQuotes(tableName.lower()))
+
     def getActiveSelectors(self):
         return self.activeSelectors
 
@@ -220,49 +445,56 @@ class Completion:
         if self.isDisabled():
             return None
 
+        timing = Stats.Timing('completion', prefix)
         autocompleteList = []
         inhibit = False
         if self.completionType == 'smart':
-            autocompleteList, inhibit = self._getAutoCompleteListSmart(prefix, sql, sqlToCursor)
+            autocompleteList, inhibit = self._getAutoCompleteListSmart(prefix, sql, sqlToCursor,
+                                                                       timing)
         else:
             autocompleteList = self._getAutoCompleteListBasic(prefix)
+        timing.mark('lookup')
 
         if not autocompleteList:
+            timing.finish()
             return None, False
 
+        # items are in priority order, so the best ones are kept
+        if self.maxItems is not None:
+            autocompleteList = autocompleteList[:self.maxItems]
+
         # return completions with or without quotes?
         # determined based on ident after last dot
-        startsWithQuote = _startsWithQuote(prefix.split(".").pop())
-        autocompleteList = [item.format(startsWithQuote) for item in autocompleteList]
+        variant = 1 if _startsWithQuote(prefix.split(".").pop()) else 0
+        autocompleteList = [item.formatted[variant] for item in autocompleteList]
+        timing.mark('format')
+        timing.finish()
 
         return autocompleteList, inhibit
 
+    # set of items from index that match any of the search strings
+    @staticmethod
+    def _matchAny(index, searchList, exactly=False):
+        matched = set()
+        for search in searchList:
+            matched.update(index.match(search, exactly))
+        return matched
+
     def _getAutoCompleteListBasic(self, prefix):
         prefix = prefix.lower()
         autocompleteList = []
 
         # columns, tables and functions that match the prefix
-        for item in self.allColumns:
-            score = item.prefixMatchScore(prefix)
-            if score:
-                autocompleteList.append(item)
-
-        for item in self.allTables:
-            score = item.prefixMatchScore(prefix)
-            if score:
-                autocompleteList.append(item)
-
-        for item in self.allFunctions:
-            score = item.prefixMatchScore(prefix)
-            if score:
-                autocompleteList.append(item)
+        autocompleteList.extend(self.columnsIndex.match(prefix, limit=self.maxItems))
+        autocompleteList.extend(self.tablesIndex.match(prefix, limit=self.maxItems))
+        autocompleteList.extend(self.functionsIndex.match(prefix, limit=self.maxItems))
 
         if len(autocompleteList) == 0:
             return None
 
         return autocompleteList
 
-    def _getAutoCompleteListSmart(self, prefix, sql, sqlToCursor):
+    def _getAutoCompleteListSmart(self, prefix, sql, sqlToCursor, timing=None):
         """
         Generally, we recognize 3 different variations in prefix:
           * ident|           // no dots (.) in prefix
@@ -287,16 +519,19 @@ class Completion:
         """
 
         # TODO: add completions of function out fields
+        sqlWithoutPrefix = _stripCursorIdent(sql, sqlToCursor, prefix)
         prefix = prefix.lower()
         prefixDots = prefix.count('.')
 
         # continue with empty identifiers list, even if we failed to parse identifiers
         identifiers = []
         try:
-            identifiers = extractTables(sql)
+            identifiers = extractTablesCached(sqlWithoutPrefix)
         except Exception as e:
             logger.debug('Failed to extact the list identifiers from SQL:\n {}'.format(sql),
                          exc_info=True)
+        if timing:
+            timing.mark('extract tables')
 
         # joinAlias is set only if user is editing join condition with alias. E.g.
         # SELECT a.* from tbl_a a inner join tbl_b b ON |
@@ -361,32 +596,32 @@ class Completion:
             if ident.is_function:
                 identFunctions.add(ident.full_name)
             elif ident.is_table_alias:
-                identTables.add(ident.full_name)
+                identTables.update(self._tablesNamed(ident.full_name))
                 identColumns.add(ident.name + '.' + prefix)
 
-        for table in self.allTables:
-            score = table.prefixMatchScore(prefix, exactly=False)
-            if score:
-                if table.prefixMatchListScore(identTables, exactly=True) > 0:
-                    sqlTables.append(table)
-                else:
-                    otherTables.append(table)
+        # items which are referenced in current statement
+        identColumns = self._matchAny(self.columnsIndex, identColumns, exactly=False)
+        identFunctions = self._matchAny(self.functionsIndex, identFunctions, exactly=True)
 
-        for col in self.allColumns:
-            score = col.prefixMatchScore(prefix, exactly=False)
-            if score:
-                if col.prefixMatchListScore(identColumns, exactly=False) > 0:
-                    sqlColumns.append(col)
-                else:
-                    otherColumns.append(col)
+        # with too many matches, those referenced in statement are kept
+        limit = self.maxItems
+        for table in self.tablesIndex.match(prefix, limit=limit, preferred=identTables):
+            if table in identTables:
+                sqlTables.append(table)
+            else:
+                otherTables.append(table)
 
-        for fun in self.allFunctions:
-            score = fun.prefixMatchScore(prefix, exactly=False)
-            if score:
-                if fun.prefixMatchListScore(identFunctions, exactly=True) > 0:
-                    sqlColumns.append(fun)
-                else:
-                    otherColumns.append(fun)
+        for col in self.columnsIndex.match(prefix, limit=limit, preferred=identColumns):
+            if col in identColumns:
+                sqlColumns.append(col)
+            else:
+                otherColumns.append(col)
+
+        for fun in self.functionsIndex.match(prefix, limit=limit, preferred=identFunctions):
+            if fun in identFunctions:
+                sqlColumns.append(fun)
+            else:
+                otherColumns.append(fun)
 
         # keywords
         for item in self.allKeywords:
@@ -447,12 +682,7 @@ class Completion:
                     sqlQueryAliases.add(ident.alias)
 
                 if ident.is_table_alias:
-                    tables = [
-                        table
-                        for table in self.allTables
-                        if table.prefixMatchScore(ident.full_name, exactly=True) > 0
-                    ]
-                    sqlTableAliases.update(tables)
+                    sqlTableAliases.update(self._tablesNamed(ident.full_name))
 
         autocompleteList = []
 
@@ -467,26 +697,12 @@ class Completion:
         # e.g. select x.co| from tab x   //  "x.co" will expland to "tab.co"
         for table_item in sqlTableAliases:
             prefix_to_match = table_item.name + '.' + prefixObject
-            for item in self.allColumns:
-                score = item.prefixMatchScore(prefix_to_match)
-                if score:
-                    autocompleteList.append(item)
+            autocompleteList.extend(self.columnsIndex.match(prefix_to_match))
 
         # try to match all our other objects (tables, columns, functions) with prefix
-        for item in self.allColumns:
-            score = item.prefixMatchScore(prefix)
-            if score:
-                autocompleteList.append(item)
-
-        for item in self.allTables:
-            score = item.prefixMatchScore(prefix)
-            if score:
-                autocompleteList.append(item)
-
-        for item in self.allFunctions:
-            score = item.prefixMatchScore(prefix)
-            if score:
-                autocompleteList.append(item)
+        autocompleteList.extend(self.columnsIndex.match(prefix, limit=self.maxItems))
+        autocompleteList.extend(self.tablesIndex.match(prefix, limit=self.maxItems))
+        autocompleteList.extend(self.functionsIndex.match(prefix, limit=self.maxItems))
 
         inhibit = len(autocompleteList) > 0
         # in case prefix parent is a query alias we simply don't know what those
@@ -498,11 +714,7 @@ class Completion:
 
     # match only columns if prefix contains multiple dots (db.table.col)
     def _multiDotCompletions(self, prefix, identifiers):
-        autocompleteList = []
-        for item in self.allColumns:
-            score = item.prefixMatchScore(prefix)
-            if score:
-                autocompleteList.append(item)
+        autocompleteList = self.columnsIndex.match(prefix, limit=self.maxItems)
 
         if len(autocompleteList) > 0:
             return autocompleteList, True
@@ -513,50 +725,155 @@ class Completion:
         if not joinAlias:
             return None
 
-        # use set, as we are interested only in unique identifiers
-        sqlTableAliases = set()
-        joinAliasColumns = set()
-        sqlOtherColumns = set()
-
+        # (alias, lookup name of table) of the joined table and of the others
+        joinTables = []
+        otherTables = []
         for ident in identifiers:
             if ident.has_alias() and not ident.is_function:
-                sqlTableAliases.add(CompletionItem('Alias', ident.alias))
+                aliasedTable = (ident.alias, _stripQuotes(ident.name.lower()))
+                tables = joinTables if ident.alias == joinAlias else otherTables
+                if aliasedTable not in tables:
+                    tables.append(aliasedTable)
 
-                prefixForColumnMatch = ident.name + '.'
-                columns = [
-                    (ident.alias, col)
-                    for col in self.allColumns
-                    if (col.prefixMatchScore(prefixForColumnMatch, exactly=True) > 0 and
-                        _stripQuotes(col.name).lower().endswith('id'))
-                ]
+        joinCandidatesCompletions = []
+        conditions = set()
+
+        def addCondition(sideA, sideB):
+            if (sideA, sideB) in conditions:
+                return
+            conditions.add((sideA, sideB))
+            joinCandidatesCompletions.append(CompletionItem('Condition', sideA + ' = ' + sideB))
+            joinCandidatesCompletions.append(CompletionItem('Condition', sideB + ' = ' + sideA))
+
+        # foreign keys are the most precise candidates, so they go first
+        for joinAlias, joinTable in joinTables:
+            for column, refTable, refColumn in self.foreignKeys.get(joinTable, ()):
+                for otherAlias, otherTable in otherTables:
+                    if otherTable == refTable:
+                        addCondition(joinAlias + '.' + column, otherAlias + '.' + refColumn)
+
+        # then columns of other tables which names end with name of the
+        # joined table column (e.g. user_id ~ id of table user)
+        for joinAlias, joinTable in joinTables:
+            for joinColumn, columnsToMatch in self._idColumns(joinTable)[0]:
+                for otherAlias, otherTable in otherTables:
+                    bySuffix = self._idColumns(otherTable)[1]
+                    matched = set()
+                    for suffix in columnsToMatch:
+                        for otherColumn in bySuffix.get(suffix, ()):
+                            if otherColumn not in matched:
+                                matched.add(otherColumn)
+                                addCondition(joinAlias + '.' + joinColumn.name,
+                                             otherAlias + '.' + otherColumn.name)
 
-                if ident.alias == joinAlias:
-                    joinAliasColumns.update(columns)
-                else:
-                    sqlOtherColumns.update(columns)
+        return joinCandidatesCompletions
 
-        joinCandidatesCompletions = []
-        for joinAlias, joinColumn in joinAliasColumns:
-            # str.endswith can be matched against a tuple
-            columnsToMatch = None
-            if _stripQuotes(joinColumn.name).lower() == 'id':
-                columnsToMatch = (
-                    _stripQuotes(joinColumn.parent).lower() + _stripQuotes(joinColumn.name).lower(),
-                    _stripQuotes(joinColumn.parent).lower() + '_' + _stripQuotes(joinColumn.name).lower()
-                )
+    def _idColumns(self, tableName):
+        """Return id-like columns of table (those ending with "id"), as list of
+        (column, names of columns it can be joined with) and dict of columns by
+        each suffix of their (lower-cased and unquoted) names."""
+        idColumns = self.idColumnsByTable.get(tableName)
+        if idColumns is not None:
+            return idColumns
+
+        columns = []
+        bySuffix = {}
+        for column in self._tableColumns(tableName):
+            name = _stripQuotes(column.name).lower()
+            if not name.endswith('id'):
+                continue
+
+            parent = _stripQuotes(column.parent).lower()
+            # other column should end with one of these
+            if name == 'id':
+                columnsToMatch = (parent + name, parent + '_' + name)
             else:
-                columnsToMatch = (
-                    _stripQuotes(joinColumn.name).lower(),
-                    _stripQuotes(joinColumn.parent).lower() + _stripQuotes(joinColumn.name).lower(),
-                    _stripQuotes(joinColumn.parent).lower() + '_' + _stripQuotes(joinColumn.name).lower()
-                )
+                columnsToMatch = (name, parent + name, parent + '_' + name)
+            columns.append((column, columnsToMatch))
 
-            for otherAlias, otherColumn in sqlOtherColumns:
-                if _stripQuotes(otherColumn.name).lower().endswith(columnsToMatch):
-                    sideA = joinAlias + '.' + joinColumn.name
-                    sideB = otherAlias + '.' + otherColumn.name
+            for start in range(len(name) - 1):
+                bySuffix.setdefault(name[start:], []).append(column)
 
-                    joinCandidatesCompletions.append(CompletionItem('Condition', sideA + ' = ' + sideB))
-                    joinCandidatesCompletions.append(CompletionItem('Condition', sideB + ' = ' + sideA))
+        idColumns = self.idColumnsByTable[tableName] = (columns, bySuffix)
+        return idColumns
 
-        return joinCandidatesCompletions
+
+class CompletionWorker(object):
+    """Computes completions in background thread, so typing is not blocked.
+
+    Requests are identified by key (e.g. view, its change count and cursor
+    position). Only the latest request is computed, once there was no newer
+    one for `delay` seconds, older requests are dropped. Callback of each
+    request is called once: with the result, or with None if the request was
+    dropped or became stale while being computed. Result of the latest
+    computed request is kept, so it can be served if the same request comes
+    again (see `result`).
+    """
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.condition = Condition()
+        self.pending = None    # (key, fn, callback, time of submit)
+        self.latest = None     # key of the latest request
+        self.completed = None  # (key, result) of the latest computed request
+        self.thread = None
+        self.stopped = False
+
+    def submit(self, key, fn, callback=None):
+        with self.condition:
+            dropped = self.pending
+            self.pending = (key, fn, callback, time.time())
+            self.latest = key
+            if self.thread is None:
+                self.thread = Thread(target=self._work, name='CompletionWorker')
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+
+        if dropped is not None and dropped[2] is not None:
+            dropped[2](None)
+
+    def isLatest(self, key):
+        return key == self.latest
+
+    def result(self, key):
+        """Return (True, result) if the request was computed, else (False, None)."""
+        completed = self.completed
+        if completed is not None and completed[0] == key:
+            return True, completed[1]
+        return False, None
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.stopped:
+                    self.condition.wait()
+                # wait until there is no newer request for the delay
+                while self.pending is not None and not self.stopped:
+                    remaining = self.pending[3] + self.delay - time.time()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                if self.stopped:
+                    return
+                key, fn, callback, submitted = self.pending
+                self.pending = None
+
+            try:
+                result = fn()
+            except Exception:
+                logger.exception('Failed to compute completions')
+                result = None
+
+            with self.condition:
+                stale = key != self.latest
+                if not stale:
+                    self.completed = (key, result)
+
+            if callback is not None:
+                callback(None if stale else result)
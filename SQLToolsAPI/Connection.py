@@ -2,10 +2,15 @@ import shutil
 import shlex
 import codecs
 import logging
-import sqlparse
+
+from concurrent.futures import Future
 
 from . import Utils as U
+from . import ParseUtils as P
 from . import Command as C
+from . import Session as S
+from . import ResultSet as R
+from . import Stats
 
 logger = logging.getLogger(__name__)
 
@@ -70,57 +75,102 @@ You might need to restart the editor for settings to be refreshed."""
         self.show_query = settings.get('show_query', False)
         self.rowsLimit  = settings.get('show_records', {}).get('limit', 50)
         self.useStreams = settings.get('use_streams', False)
+        self.resultSizeLimit = settings.get('result_size_limit', 0)
+        self.parallelQueries = settings.get('parallel_queries', 0)
         self.cli        = settings.get('cli')[self.options['type']]
+        # style of table output of the CLI, for parsing it into result sets
+        self.resultStyle = R.getStyle(self.type)
 
         cli_path = shutil.which(self.cli)
         if cli_path is None:
             logger.info(self.DB_CLI_NOT_FOUND_MESSAGE.format(self.cli))
             raise FileNotFoundError(self.DB_CLI_NOT_FOUND_MESSAGE.format(self.cli))
 
+        # keep DB CLI processes running between queries (only if the CLI
+        # options define how to print the marker of the end of the output)
+        self.sessionPool = None
+        if settings.get('use_sessions', False):
+            cliOptions = self.getOptionsForSgdbCli()
+            marker = cliOptions.get('session_marker')
+            if marker:
+                self.sessionPool = S.getPool(name,
+                                             prologue=cliOptions.get('before'),
+                                             epilogue=cliOptions.get('after'),
+                                             marker=marker,
+                                             idleTimeout=settings.get('session_idle_timeout', 300),
+                                             terminator=cliOptions.get('session_terminator'))
+            else:
+                logger.info('sessions are not supported for "%s", no session_marker', self.type)
+
     def __str__(self):
         return self.name
 
+    def closeSessions(self):
+        if self.sessionPool is not None:
+            self.sessionPool.closeAll()
+
     def info(self):
         return 'DB: {0}, Connection: {1}@{2}:{3}'.format(
             self.database, self.username, self.host, self.port)
 
+    # callback gets the list of lines of the output, or None if the query
+    # did not finish in time (the output is incomplete then)
     def runInternalNamedQueryCommand(self, queryName, callback):
         query = self.getNamedQuery(queryName)
         if not query:
             emptyList = []
             callback(emptyList)
-            return
+            future = Future()
+            future.set_result(None)
+            return future
 
+        timing = self.timing(queryName)
         queryToRun = self.buildNamedQuery(queryName, query)
         args = self.buildArgs(queryName)
         env = self.buildEnv()
+        timing.mark('prepare')
 
+        # incomplete output of the killed process comes before the timeout
+        # message, callback gets the list first and then None
         def cb(result):
+            if result.startswith(C.TIMEOUT_MESSAGE):
+                callback(None)
+                return
             callback(U.getResultAsList(result))
 
-        self.Command.createAndRun(args=args,
-                                  env=env,
-                                  callback=cb,
-                                  query=queryToRun,
-                                  encoding=self.encoding,
-                                  timeout=60,
-                                  silenceErrors=True,
-                                  stream=False)
+        return self.Command.createAndRun(args=args,
+                                         env=env,
+                                         callback=cb,
+                                         query=queryToRun,
+                                         encoding=self.encoding,
+                                         options={'timing': timing,
+                                                  'session_scope': self.sessionScope(queryName)},
+                                         timeout=60,
+                                         silenceErrors=True,
+                                         stream=False,
+                                         sessionPool=self.sessionPool,
+                                         connection=self.name)
 
     def getTables(self, callback):
-        self.runInternalNamedQueryCommand('desc', callback)
+        return self.runInternalNamedQueryCommand('desc', callback)
 
     def getColumns(self, callback):
-        self.runInternalNamedQueryCommand('columns', callback)
+        return self.runInternalNamedQueryCommand('columns', callback)
 
     def getFunctions(self, callback):
-        self.runInternalNamedQueryCommand('functions', callback)
+        return self.runInternalNamedQueryCommand('functions', callback)
+
+    # foreign keys as "table.column=table.column" (optional query)
+    def getForeignKeys(self, callback):
+        return self.runInternalNamedQueryCommand('foreign keys', callback)
 
-    def runFormattedNamedQueryCommand(self, queryName, formatValues, callback):
+    def runFormattedNamedQueryCommand(self, queryName, formatValues, callback, owner=None):
         query = self.getNamedQuery(queryName)
         if not query:
             return
 
+        timing = self.timing(queryName)
+
         # added for compatibility with older format string
         query = query.replace("%s", "{0}", 1)
         query = query.replace("%s", "{1}", 1)
@@ -133,51 +183,67 @@ You might need to restart the editor for settings to be refreshed."""
         queryToRun = self.buildNamedQuery(queryName, query)
         args = self.buildArgs(queryName)
         env = self.buildEnv()
-        self.Command.createAndRun(args=args,
-                                  env=env,
-                                  callback=callback,
-                                  query=queryToRun,
-                                  encoding=self.encoding,
-                                  timeout=self.timeout,
-                                  silenceErrors=False,
-                                  stream=False)
-
-    def getTableRecords(self, tableName, callback):
+        timing.mark('prepare')
+        return self.Command.createAndRun(args=args,
+                                         env=env,
+                                         callback=callback,
+                                         query=queryToRun,
+                                         encoding=self.encoding,
+                                         options={'result_size_limit': self.resultSizeLimit,
+                                                  'timing': timing,
+                                                  'session_scope': self.sessionScope(queryName)},
+                                         timeout=self.timeout,
+                                         silenceErrors=False,
+                                         stream=False,
+                                         sessionPool=self.sessionPool,
+                                         connection=self.name,
+                                         owner=owner)
+
+    def getTableRecords(self, tableName, callback, owner=None):
         # in case we expect multiple values pack them into tuple
         formatValues = (tableName, self.rowsLimit)
-        self.runFormattedNamedQueryCommand('show records', formatValues, callback)
+        return self.runFormattedNamedQueryCommand('show records', formatValues, callback, owner)
 
-    def getTableDescription(self, tableName, callback):
-        self.runFormattedNamedQueryCommand('desc table', tableName, callback)
+    def getTableDescription(self, tableName, callback, owner=None):
+        return self.runFormattedNamedQueryCommand('desc table', tableName, callback, owner)
 
-    def getFunctionDescription(self, functionName, callback):
-        self.runFormattedNamedQueryCommand('desc function', functionName, callback)
+    def getFunctionDescription(self, functionName, callback, owner=None):
+        return self.runFormattedNamedQueryCommand('desc function', functionName, callback, owner)
 
-    def explainPlan(self, queries, callback):
+    def explainPlan(self, queries, callback, owner=None):
         queryName = 'explain plan'
         explainQuery = self.getNamedQuery(queryName)
         if not explainQuery:
             return
 
+        timing = self.timing(queryName)
         strippedQueries = [
-            explainQuery.format(query.strip().strip(";"))
+            explainQuery.format(statement.text.strip(";"))
             for rawQuery in queries
-            for query in filter(None, sqlparse.split(rawQuery))
+            for statement in P.splitStatements(rawQuery)
         ]
         queryToRun = self.buildNamedQuery(queryName, strippedQueries)
         args = self.buildArgs(queryName)
         env = self.buildEnv()
-        self.Command.createAndRun(args=args,
-                                  env=env,
-                                  callback=callback,
-                                  query=queryToRun,
-                                  encoding=self.encoding,
-                                  timeout=self.timeout,
-                                  silenceErrors=False,
-                                  stream=self.useStreams)
-
-    def execute(self, queries, callback, stream=None):
+        timing.mark('prepare')
+        return self.Command.createAndRun(args=args,
+                                         env=env,
+                                         callback=callback,
+                                         query=queryToRun,
+                                         encoding=self.encoding,
+                                         options={'result_size_limit': self.resultSizeLimit,
+                                                  'timing': timing,
+                                                  'session_scope': self.sessionScope(queryName)},
+                                         timeout=self.timeout,
+                                         silenceErrors=False,
+                                         stream=self.useStreams,
+                                         sessionPool=self.sessionPool,
+                                         connection=self.name,
+                                         owner=owner)
+
+    def execute(self, queries, callback, stream=None, owner=None):
         queryName = 'execute'
+        timing = self.timing(queryName)
 
         # if not explicitly overriden, use the value from settings
         if stream is None:
@@ -192,37 +258,70 @@ You might need to restart the editor for settings to be refreshed."""
 
         processedQueriesList = []
         for rawQuery in queries:
-            for query in sqlparse.split(rawQuery):
-                if self.safe_limit:
-                    parsedTokens = sqlparse.parse(query.strip().replace("'", "\""))
-                    if ((parsedTokens[0][0].ttype in sqlparse.tokens.Keyword and
-                            parsedTokens[0][0].value == 'select')):
-                        applySafeLimit = True
-                        for parse in parsedTokens:
-                            for token in parse.tokens:
-                                if token.ttype in sqlparse.tokens.Keyword and token.value == 'limit':
-                                    applySafeLimit = False
-                        if applySafeLimit:
-                            if (query.strip()[-1:] == ';'):
-                                query = query.strip()[:-1]
-                            query += " LIMIT {0};".format(self.safe_limit)
+            # statement type and LIMIT presence are found while splitting
+            for statement in P.splitStatements(rawQuery):
+                query = statement.text
+                if self.safe_limit and statement.type == 'SELECT' and not statement.has_limit:
+                    if query[-1:] == ';':
+                        query = query[:-1]
+                    query += " LIMIT {0};".format(self.safe_limit)
                 processedQueriesList.append(query)
 
-        queryToRun = self.buildNamedQuery(queryName, processedQueriesList)
         args = self.buildArgs(queryName)
         env = self.buildEnv()
 
+        # independent queries can be run each by its own process at once
+        if (self.parallelQueries > 1 and len(processedQueriesList) > 1 and
+                hasattr(self.Command, 'createAndRunParallel')):
+            queriesToRun = [self.buildNamedQuery(queryName, [query])
+                            for query in processedQueriesList]
+            logger.debug("Queries (parallel): %s", str(queriesToRun))
+
+            return self.Command.createAndRunParallel(args=args,
+                                                     env=env,
+                                                     callback=callback,
+                                                     queries=queriesToRun,
+                                                     parallel=self.parallelQueries,
+                                                     encoding=self.encoding,
+                                                     options={'show_query': self.show_query,
+                                                              'result_size_limit': self.resultSizeLimit,
+                                                              'session_scope': self.sessionScope(queryName)},
+                                                     timeout=self.timeout,
+                                                     silenceErrors=False,
+                                                     sessionPool=self.sessionPool,
+                                                     connection=self.name,
+                                                     owner=owner)
+
+        queryToRun = self.buildNamedQuery(queryName, processedQueriesList)
+        timing.mark('prepare')
+
         logger.debug("Query: %s", str(queryToRun))
 
-        self.Command.createAndRun(args=args,
-                                  env=env,
-                                  callback=callback,
-                                  query=queryToRun,
-                                  encoding=self.encoding,
-                                  options={'show_query': self.show_query},
-                                  timeout=self.timeout,
-                                  silenceErrors=False,
-                                  stream=stream)
+        return self.Command.createAndRun(args=args,
+                                         env=env,
+                                         callback=callback,
+                                         query=queryToRun,
+                                         encoding=self.encoding,
+                                         options={'show_query': self.show_query,
+                                                  'result_size_limit': self.resultSizeLimit,
+                                                  'timing': timing,
+                                                  'session_scope': self.sessionScope(queryName)},
+                                         timeout=self.timeout,
+                                         silenceErrors=False,
+                                         stream=stream,
+                                         sessionPool=self.sessionPool,
+                                         connection=self.name,
+                                         owner=owner)
+
+    def timing(self, queryName):
+        return Stats.Timing('query', '{0}: {1}'.format(self.name, queryName))
+
+    def sessionScope(self, queryName):
+        """Query level before/after lines run in the session and their effects
+        (e.g. SET options) last, so sessions are shared only by queries which
+        have the same lines."""
+        query = self.getOptionsForSgdbCli().get('queries', {}).get(queryName, {})
+        return tuple(query.get('before') or ()), tuple(query.get('after') or ())
 
     def getNamedQuery(self, queryName):
         if not queryName:
@@ -248,6 +347,11 @@ You might need to restart the editor for settings to be refreshed."""
         if type(queries) is not list:
             queries = [queries]
 
+        # with sessions, CLI level before/after are sent once per session
+        if self.sessionPool is not None:
+            beforeCli = None
+            afterCli = None
+
         builtQueries = []
         if beforeCli is not None:
             builtQueries.extend(beforeCli)
@@ -0,0 +1,81 @@
+from array import array
+from bisect import bisect_right
+
+# appended chunks are merged until they have at least this number of
+# characters, so a page is built from a few of them only
+PART_SIZE = 64 * 1024
+
+
+class Pager(object):
+    """Keeps the whole output and serves it by pages of `pageSize` lines.
+
+    Output is kept as the appended chunks (with their offsets) and an array
+    of offsets of line starts, so the text of a page is built from slices of
+    the chunks it covers only.
+    """
+
+    def __init__(self, pageSize):
+        self.pageSize = max(1, pageSize)
+        self.parts = []
+        self.partStarts = []
+        self.size = 0
+        # offsets of line starts, last one is the start of unfinished line
+        self.lineStarts = array('L', [0])
+        self.page = 0
+
+    def append(self, text):
+        if not text:
+            return
+        if self.parts and len(self.parts[-1]) < PART_SIZE:
+            self.parts[-1] += text
+        else:
+            self.parts.append(text)
+            self.partStarts.append(self.size)
+        newline = text.find('\n')
+        while newline >= 0:
+            self.lineStarts.append(self.size + newline + 1)
+            newline = text.find('\n', newline + 1)
+        self.size += len(text)
+
+    def _slice(self, start, end):
+        """Return text of the output between start and end offsets."""
+        index = max(0, bisect_right(self.partStarts, start) - 1)
+        slices = []
+        while index < len(self.parts) and self.partStarts[index] < end:
+            partStart = self.partStarts[index]
+            slices.append(self.parts[index][max(0, start - partStart):end - partStart])
+            index += 1
+        return ''.join(slices)
+
+    def lineCount(self):
+        # the last line counts only if it is not empty
+        lines = len(self.lineStarts) - 1
+        if self.lineStarts[-1] < self.size:
+            lines += 1
+        return lines
+
+    def pageCount(self):
+        return max(1, (self.lineCount() + self.pageSize - 1) // self.pageSize)
+
+    def isPaged(self):
+        return self.lineCount() > self.pageSize
+
+    def setPage(self, page):
+        self.page = max(0, min(page, self.pageCount() - 1))
+        return self.page
+
+    def pageLines(self, page=None):
+        """Return (first, last) line numbers (1-based) of the page."""
+        page = self.page if page is None else page
+        first = page * self.pageSize
+        last = min(first + self.pageSize, self.lineCount())
+        return first + 1, last
+
+    def getPage(self, page=None):
+        page = self.page if page is None else page
+        first = page * self.pageSize
+        last = first + self.pageSize
+        if first >= len(self.lineStarts):
+            return ''
+        end = self.lineStarts[last] if last < len(self.lineStarts) else self.size
+        return self._slice(self.lineStarts[first], end)
@@ -1,16 +1,29 @@
 import os
 import sys
+import hashlib
 import itertools
-from collections import namedtuple
+from functools import lru_cache
+from threading import Lock
+from collections import namedtuple, OrderedDict
 
 dirpath = os.path.join(os.path.dirname(__file__), 'lib')
 if dirpath not in sys.path:
     sys.path.append(dirpath)
 
-import sqlparse
+# sqlparse is imported on first use (see _importSqlparse), as importing it
+# compiles all of its regular expressions, which slows down plugin startup
+sqlparse = None
 
-from sqlparse.sql import IdentifierList, Identifier, Function
-from sqlparse.tokens import Keyword, DML
+# number of most recently parsed sql texts to keep the identifiers of
+EXTRACT_TABLES_CACHE_SIZE = 64
+
+# number of most recently executed scripts to keep the statements of
+SPLIT_STATEMENTS_CACHE_SIZE = 16
+# larger scripts (e.g. dumps) are split again each time they are executed
+SPLIT_STATEMENTS_CACHE_MAX_LENGTH = 1024 * 1024
+
+
+Statement = namedtuple('Statement', ['text', 'type', 'has_limit'])
 
 
 class Reference(namedtuple('Reference', ['schema', 'name', 'alias', 'is_function'])):
@@ -35,6 +48,21 @@ class Reference(namedtuple('Reference', ['schema', 'name', 'alias', 'is_function
             return self.schema + '.' + self.name
 
 
+def _importSqlparse():
+    global lexer, StatementSplitter, IdentifierList, Identifier, Function
+    global Keyword, DML, DDL, Punctuation, Whitespace, Comment, Error, sqlparse
+    if sqlparse is not None:
+        return
+
+    import sqlparse as module
+    from sqlparse import lexer
+    from sqlparse.engine import StatementSplitter
+    from sqlparse.sql import IdentifierList, Identifier, Function
+    from sqlparse.tokens import Keyword, DML, DDL, Punctuation, Whitespace, Comment, Error
+    # set last, other threads may use the names once it is set
+    sqlparse = module
+
+
 def _is_subselect(parsed):
     if not parsed.is_group:
         return False
@@ -110,6 +138,7 @@ def _extract_table_identifiers(token_stream):
 
 
 def extractTables(sql):
+    _importSqlparse()
     # let's handle multiple statements in one sql string
     extracted_tables = []
     statements = list(sqlparse.parse(sql))
@@ -117,3 +146,133 @@ def extractTables(sql):
         stream = _extract_from_part(statement)
         extracted_tables.append(list(_extract_table_identifiers(stream)))
     return list(itertools.chain(*extracted_tables))
+
+
+# while typing, the text of the statement (apart from the identifier under
+# cursor) usually does not change, so parsing the same sql again is avoided
+@lru_cache(maxsize=EXTRACT_TABLES_CACHE_SIZE)
+def _extractTablesCached(sql):
+    return tuple(extractTables(sql))
+
+
+def extractTablesCached(sql):
+    return list(_extractTablesCached(sql))
+
+
+def extractTablesCacheInfo():
+    """Return named tuple with hits, misses, maxsize and currsize of cache."""
+    return _extractTablesCached.cache_info()
+
+
+def extractTablesCacheClear():
+    _extractTablesCached.cache_clear()
+
+
+class _StatementInspector(object):
+    """Collects the type of the statement (first DML or DDL keyword,
+    upper-cased, as in Statement.get_type) and whether it has LIMIT outside
+    of subqueries, from the tokens passed by StatementSplitter."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.type = None
+        self.hasLimit = False
+        # LIMIT seen in each of the open parentheses, these only count if
+        # the parenthesis is not closed (as it is not grouped then)
+        self.parentheses = []
+
+    def __call__(self, ttype, value):
+        if ttype in Keyword:
+            if self.type is None:
+                self.type = value.upper() if ttype in (DML, DDL) else ''
+            if value.upper() == 'LIMIT':
+                if self.parentheses:
+                    self.parentheses[-1] = True
+                else:
+                    self.hasLimit = True
+        elif ttype is Punctuation:
+            if self.type is None:
+                self.type = ''
+            if value == '(':
+                self.parentheses.append(False)
+            elif value == ')':
+                if self.parentheses:
+                    self.parentheses.pop()
+        elif self.type is None and ttype not in Whitespace and ttype not in Comment:
+            self.type = ''
+
+
+def _statementOffsets(sql):
+    """Return tuple of (start, end, type, has_limit) of statements of sql,
+    split the same way as sqlparse.split (see _StatementInspector)."""
+    _importSqlparse()
+    inspector = _StatementInspector()
+    offsets = []
+    for start, end in StatementSplitter().process_offsets(lexer.tokenize(sql), inspector):
+        text = sql[start:end]
+        stripped = text.strip()
+        if stripped:
+            start += len(text) - len(text.lstrip())
+            offsets.append((start, start + len(stripped), inspector.type or 'UNKNOWN',
+                            inspector.hasLimit or any(inspector.parentheses)))
+        inspector.reset()
+    return tuple(offsets)
+
+
+def endsWithTerminator(sql, terminator=';'):
+    """Whether the last statement of sql is finished by terminator, which is
+    not inside of comment, string or block (e.g. BEGIN ... END), only
+    whitespace and comments may follow it. Unclosed quotes (which the lexer
+    returns as errors) anywhere in sql make it unfinished."""
+    _importSqlparse()
+    last = None
+    hasError = False
+
+    def inspect(ttype, value):
+        nonlocal last, hasError
+        if ttype is Error:
+            hasError = True
+        elif ttype not in Whitespace and ttype not in Comment:
+            last = value
+
+    splitter = StatementSplitter()
+    for offsets in splitter.process_offsets(lexer.tokenize(sql), inspect):
+        pass
+    return (not hasError and splitter.level <= 0 and
+            last is not None and last.lower() == terminator.lower())
+
+
+def _splitStatements(sql):
+    return tuple(Statement(sql[start:end], statementType, hasLimit)
+                 for start, end, statementType, hasLimit in _statementOffsets(sql))
+
+
+# executing the same script again (or the same selection) is common, so the
+# statements are split and inspected only once, only their offsets are kept
+# (keyed by digest of the script), not the script itself
+_statementOffsetsCache = OrderedDict()
+_statementOffsetsCacheLock = Lock()
+
+
+def splitStatements(sql):
+    """Return tuple of Statement(text, type, has_limit) of sql script."""
+    if len(sql) > SPLIT_STATEMENTS_CACHE_MAX_LENGTH:
+        return _splitStatements(sql)
+
+    key = hashlib.sha1(sql.encode('utf-8', 'surrogatepass')).digest()
+    with _statementOffsetsCacheLock:
+        offsets = _statementOffsetsCache.get(key)
+        if offsets is not None:
+            _statementOffsetsCache.move_to_end(key)
+
+    if offsets is None:
+        offsets = _statementOffsets(sql)
+        with _statementOffsetsCacheLock:
+            _statementOffsetsCache[key] = offsets
+            while len(_statementOffsetsCache) > SPLIT_STATEMENTS_CACHE_SIZE:
+                _statementOffsetsCache.popitem(last=False)
+
+    return tuple(Statement(sql[start:end], statementType, hasLimit)
+                 for start, end, statementType, hasLimit in offsets)
@@ -0,0 +1,238 @@
+"""Parsing of the table output of DB CLIs into result sets.
+
+This is API for other packages and future features (the plugin itself still
+shows the output as text), nothing in SQLTools uses it yet.
+"""
+
+import re
+import logging
+
+from array import array
+
+logger = logging.getLogger(__name__)
+
+# table output styles of DB CLIs, by connection type
+STYLES = {
+    'pgsql': 'psql',
+    'vertica': 'psql',
+    'mysql': 'mysql',
+    'sqlite': 'sqlite',
+    'mssql': 'sqlcmd'
+}
+
+# lines which separate the header of the table from its rows
+RULE_PATTERNS = {
+    # ----+------
+    'psql': re.compile(r'^-+(\+-+)*$'),
+    # +----+------+
+    'mysql': re.compile(r'^\+(-+\+)+$'),
+    # --  ------
+    'sqlite': re.compile(r'^-+( +-+)*$'),
+    # ----------- ------
+    'sqlcmd': re.compile(r'^-+( +-+)*$')
+}
+
+# lines which end the table (apart from the empty line), note that line with
+# only spaces is a row with empty values (e.g. NULLs)
+FOOTER_PATTERNS = {
+    'psql': re.compile(r'^\(\d+ rows?\)$'),
+    'mysql': re.compile(r'^\d+ rows? in set'),
+    'sqlite': None,
+    'sqlcmd': re.compile(r'^\(\d+ rows? affected\)$')
+}
+
+DASHES_REGEX = re.compile(r'-+')
+
+
+def getStyle(connectionType):
+    return STYLES.get(connectionType)
+
+
+class StringPool(object):
+    """Stores each distinct string once, strings are referenced by index."""
+
+    def __init__(self):
+        self.strings = []
+        self.indexes = {}
+
+    def add(self, string):
+        index = self.indexes.get(string)
+        if index is None:
+            index = len(self.strings)
+            self.indexes[string] = index
+            self.strings.append(string)
+        return index
+
+    def get(self, index):
+        return self.strings[index]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class ResultSet(object):
+    """Rows of single result table, stored by columns.
+
+    Each column is an array of indexes to the string pool (which is usually
+    shared by all the result sets of the output), so repeated values (NULLs,
+    flags, foreign keys, ...) take only the space of an index.
+    """
+
+    def __init__(self, columns, pool=None):
+        self.columns = list(columns)
+        self.pool = pool if pool is not None else StringPool()
+        self.data = [array('L') for column in self.columns]
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, cells):
+        cells = list(cells)
+        # missing cells are empty, extra ones are dropped
+        if len(cells) < len(self.columns):
+            cells.extend([''] * (len(self.columns) - len(cells)))
+        for column, cell in zip(self.data, cells):
+            column.append(self.pool.add(cell))
+        self.size += 1
+
+    def row(self, index):
+        strings = self.pool.strings
+        return tuple(strings[column[index]] for column in self.data)
+
+    def rows(self, start=0, stop=None):
+        """Iterate over the rows (as tuples of strings) in range start:stop."""
+        strings = self.pool.strings
+        stop = self.size if stop is None else min(stop, self.size)
+        for index in range(start, stop):
+            yield tuple(strings[column[index]] for column in self.data)
+
+    def column(self, index):
+        strings = self.pool.strings
+        return [strings[value] for value in self.data[index]]
+
+    def columnIndex(self, name):
+        return self.columns.index(name)
+
+
+class ResultParser(object):
+    """Parses table output of DB CLI line by line into result sets.
+
+    `feed` returns the row which was completed by the line (if any), so the
+    rows can be processed while the output is still being read. As the
+    header of the table is only recognized by the rule line which follows
+    it, each row is returned one line later (the last one by `close`).
+    Lines which do not belong to any table (messages, errors) are skipped.
+    """
+
+    def __init__(self, style):
+        if style not in RULE_PATTERNS:
+            raise ValueError('Unknown result style: {0}'.format(style))
+        self.style = style
+        self.rule = RULE_PATTERNS[style]
+        self.footer = FOOTER_PATTERNS[style]
+        self.pool = StringPool()
+        self.resultSets = []
+        self.current = None
+        self.spans = None
+        self.pending = None
+        # mysql: number of rules of the current table, the header is between
+        # the first two of them and the rows between the second and third
+        self.rules = 0
+
+    def feed(self, line):
+        line = line.rstrip('\r\n')
+
+        if self.style == 'mysql':
+            return self._feedMysql(line)
+
+        pending = self.pending
+        self.pending = line
+
+        if self.rule.match(line.strip()) and pending is not None and pending.strip():
+            # pending line is the header of new table
+            self._startResultSet(pending, line)
+            self.pending = None
+            return None
+
+        if pending is None or self.current is None:
+            return None
+
+        if self._endsTable(pending):
+            self.current = None
+            return None
+
+        return self._addRow(pending)
+
+    def close(self):
+        """Process the last line, returns the row it completes (if any)."""
+        row = None
+        if self.style != 'mysql':
+            pending = self.pending
+            self.pending = None
+            if pending is not None and self.current is not None and not self._endsTable(pending):
+                row = self._addRow(pending)
+        self.current = None
+        self.rules = 0
+        return row
+
+    def _endsTable(self, line):
+        return not line or (self.footer is not None and
+                            self.footer.match(line.strip()) is not None)
+
+    def _feedMysql(self, line):
+        if self.rule.match(line.strip()):
+            if self.rules == 0 or (self.rules == 1 and self.current is None):
+                self.rules = 1
+                self.spans = self._spans(line)
+            elif self.rules == 1:
+                self.rules = 2
+            else:
+                self.current = None
+                self.rules = 0
+            return None
+
+        if self.rules == 1:
+            if self.current is None:
+                self._newResultSet(self._cells(line))
+            return None
+
+        if self.rules == 2 and self.current is not None:
+            return self._addRow(line)
+        return None
+
+    def _startResultSet(self, header, rule):
+        self.spans = self._spans(rule)
+        self._newResultSet(self._cells(header))
+
+    def _newResultSet(self, columns):
+        self.current = ResultSet(columns, self.pool)
+        self.resultSets.append(self.current)
+
+    def _addRow(self, line):
+        self.current.append(self._cells(line))
+        return self.current.row(self.current.size - 1)
+
+    def _spans(self, rule):
+        """Get (start, end) of columns from the rule line."""
+        offset = len(rule) - len(rule.lstrip())
+        spans = [(m.start() + offset, m.end() + offset)
+                 for m in DASHES_REGEX.finditer(rule.strip())]
+        if self.style in ('sqlite', 'sqlcmd'):
+            # values may not fit into the column, so each column is up
+            # to the start of the next one (and the last to the end of line)
+            starts = [start for start, end in spans]
+            spans = list(zip(starts, starts[1:] + [None]))
+        return spans
+
+    def _cells(self, line):
+        return [line[start:end].strip() for start, end in self.spans]
+
+
+def parseResult(text, style):
+    """Parse the output of DB CLI, returns list of ResultSets."""
+    parser = ResultParser(style)
+    for line in text.splitlines():
+        parser.feed(line)
+    parser.close()
+    return parser.resultSets
@@ -0,0 +1,304 @@
+import os
+import time
+import logging
+import itertools
+import subprocess
+
+from queue import Queue
+from threading import Thread, Lock
+
+from . import ParseUtils as P
+
+logger = logging.getLogger(__name__)
+
+# how often (in seconds) idle sessions are checked for recycling
+REAPER_INTERVAL = 30
+
+# larger query batches (e.g. dumps) are not lexed to check their terminator,
+# they are run by separate process
+MAX_CHECKED_QUERY_LENGTH = 1024 * 1024
+
+_markerCounter = itertools.count()
+
+
+class Session(object):
+    """Long running DB CLI process which receives query batches on stdin.
+
+    End of the output of each batch is detected by a unique marker that is
+    printed by the CLI itself once all preceding queries were processed.
+    The marker is printed by `marker` lines (list of strings, where `{marker}`
+    is replaced by actual marker), e.g. for psql: ["\\echo {marker}"].
+    """
+
+    def __init__(self, args, env, encoding='utf-8', silenceErrors=False,
+                 prologue=None, epilogue=None, marker=None):
+        self.args = list(args)
+        self.env = env
+        self.encoding = encoding
+        self.silenceErrors = silenceErrors
+        self.prologue = list(filter(None, prologue or []))
+        self.epilogue = list(filter(None, epilogue or []))
+        self.marker = marker or []
+        self.key = None
+        self.process = None
+        self.lines = Queue()
+        self.lastUsed = time.time()
+
+    def start(self):
+        si = None
+        if os.name == 'nt':
+            si = subprocess.STARTUPINFO()
+            si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+
+        stderrHandle = subprocess.STDOUT
+        if self.silenceErrors:
+            stderrHandle = subprocess.DEVNULL
+
+        self.process = subprocess.Popen(self.args,
+                                        stdout=subprocess.PIPE,
+                                        stderr=stderrHandle,
+                                        stdin=subprocess.PIPE,
+                                        env=self.env,
+                                        startupinfo=si)
+
+        # reading is done in separate thread, so the process is never blocked
+        # on a full stdout pipe while we are still writing the next batch
+        reader = Thread(target=self._readOutput, args=(self.process, self.lines))
+        reader.daemon = True
+        reader.start()
+
+        if self.prologue:
+            self._write('\n'.join(self.prologue))
+
+        logger.debug('session started (pid %s)', self.process.pid)
+
+    @staticmethod
+    def _readOutput(process, lines):
+        for line in process.stdout:
+            lines.put(line)
+        # None signals that process has terminated
+        lines.put(None)
+
+    def _write(self, text):
+        self.process.stdin.write((text + '\n').encode(self.encoding))
+        self.process.stdin.flush()
+
+    def isAlive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def isIdleFor(self, seconds):
+        return time.time() - self.lastUsed > seconds
+
+    def execute(self, query, callback=None, raw=False):
+        """Send the query batch to the process and collect its output.
+
+        If callback is passed, it is called for every line of the output
+        (streaming, lines are passed undecoded if `raw`), otherwise the entire
+        output is returned as a string.
+        """
+        marker = '__SQLTOOLS_END_{0}__'.format(next(_markerCounter))
+        markerQuery = '\n'.join(line.format(marker=marker) for line in self.marker)
+        markerBytes = marker.encode(self.encoding)
+
+        output = []
+        try:
+            self._write('{0}\n{1}'.format(query, markerQuery))
+        except (OSError, ValueError):
+            logger.info('session process (pid %s) is gone', self.process.pid)
+            self.close()
+            return ''
+
+        while True:
+            line = self.lines.get()
+            if line is None:
+                # process died (or was killed) before printing the marker
+                self.process = None
+                break
+
+            if line.strip() == markerBytes:
+                break
+
+            if raw:
+                callback(line)
+                continue
+
+            line = line.decode(self.encoding, 'replace').replace('\r', '')
+            if callback:
+                callback(line)
+            else:
+                output.append(line)
+
+        self.lastUsed = time.time()
+        return ''.join(output)
+
+    def close(self):
+        if not self.isAlive():
+            self.process = None
+            return
+
+        process = self.process
+        self.process = None
+        try:
+            if self.epilogue:
+                process.stdin.write(('\n'.join(self.epilogue) + '\n').encode(self.encoding))
+            process.stdin.close()
+            process.wait(timeout=5)
+        except Exception:
+            process.kill()
+
+        logger.debug('session closed (pid %s)', process.pid)
+
+
+class SessionPool(object):
+    """Pool of warm sessions of single connection.
+
+    Sessions are keyed by the CLI arguments and environment, as these differ
+    between named queries (e.g. "--tuples-only" for internal queries), and by
+    the scope given by the caller (e.g. query level before/after lines, which
+    change the state of the session).
+
+    The marker is only printed after the last statement of the batch was
+    executed, if that statement is finished by `terminator` (e.g. ";"),
+    batches which are not are run by separate process (see `accepts`).
+    """
+
+    def __init__(self, name, prologue=None, epilogue=None, marker=None,
+                 idleTimeout=300, maxIdle=2, terminator=None):
+        self.name = name
+        self.prologue = prologue
+        self.epilogue = epilogue
+        self.marker = marker
+        self.terminator = terminator
+        self.idleTimeout = idleTimeout
+        self.maxIdle = maxIdle
+        self.idle = {}
+        self.lock = Lock()
+
+    def sameOptions(self, prologue, epilogue, marker, idleTimeout, maxIdle, terminator):
+        return (self.prologue == prologue and
+                self.epilogue == epilogue and
+                self.marker == marker and
+                self.idleTimeout == idleTimeout and
+                self.maxIdle == maxIdle and
+                self.terminator == terminator)
+
+    def accepts(self, query):
+        """Whether the query batch can be run in session."""
+        if not self.terminator:
+            return True
+        if len(query) > MAX_CHECKED_QUERY_LENGTH:
+            return False
+        # terminator in comment or string, or unfinished block, would leave
+        # the statement (and the marker after it) unfinished
+        return P.endsWithTerminator(query, self.terminator)
+
+    def standaloneQuery(self, query):
+        """Query batch to run by separate process, with CLI level before and
+        after lines (which are otherwise sent once per session)."""
+        return '\n'.join(filter(None, (self.prologue or []) + [query] + (self.epilogue or [])))
+
+    @staticmethod
+    def _key(args, env, silenceErrors, scope=None):
+        return (tuple(args), tuple(sorted((env or {}).items())), silenceErrors, scope)
+
+    def acquire(self, args, env, encoding='utf-8', silenceErrors=False, scope=None):
+        args = list(args)
+        key = self._key(args, env, silenceErrors, scope)
+
+        with self.lock:
+            sessions = self.idle.get(key, [])
+            while sessions:
+                session = sessions.pop()
+                if session.isAlive() and not session.isIdleFor(self.idleTimeout):
+                    return session
+                session.close()
+
+        session = Session(args, env,
+                          encoding=encoding,
+                          silenceErrors=silenceErrors,
+                          prologue=self.prologue,
+                          epilogue=self.epilogue,
+                          marker=self.marker)
+        session.key = key
+        session.start()
+        logger.info('new session for connection "%s"', self.name)
+        return session
+
+    def release(self, session):
+        if not session.isAlive():
+            session.close()
+            return
+
+        with self.lock:
+            sessions = self.idle.setdefault(session.key, [])
+            if len(sessions) < self.maxIdle:
+                sessions.append(session)
+                return
+
+        session.close()
+
+    def prune(self):
+        with self.lock:
+            for sessions in self.idle.values():
+                expired = [s for s in sessions
+                           if not s.isAlive() or s.isIdleFor(self.idleTimeout)]
+                for session in expired:
+                    sessions.remove(session)
+                    session.close()
+
+    def closeAll(self):
+        with self.lock:
+            for sessions in self.idle.values():
+                for session in sessions:
+                    session.close()
+            self.idle = {}
+
+
+_pools = {}
+_poolsLock = Lock()
+_reaper = None
+
+
+def _reapIdleSessions():
+    while True:
+        time.sleep(REAPER_INTERVAL)
+        with _poolsLock:
+            pools = list(_pools.values())
+        for pool in pools:
+            pool.prune()
+
+
+def getPool(name, prologue=None, epilogue=None, marker=None, idleTimeout=300, maxIdle=2,
+            terminator=None):
+    global _reaper
+
+    with _poolsLock:
+        pool = _pools.get(name)
+        if pool and not pool.sameOptions(prologue, epilogue, marker, idleTimeout, maxIdle,
+                                         terminator):
+            pool.closeAll()
+            pool = None
+
+        if pool is None:
+            pool = SessionPool(name,
+                               prologue=prologue,
+                               epilogue=epilogue,
+                               marker=marker,
+                               idleTimeout=idleTimeout,
+                               maxIdle=maxIdle,
+                               terminator=terminator)
+            _pools[name] = pool
+
+        if _reaper is None:
+            _reaper = Thread(target=_reapIdleSessions)
+            _reaper.daemon = True
+            _reaper.start()
+
+    return pool
+
+
+def closeAllPools():
+    with _poolsLock:
+        for pool in _pools.values():
+            pool.closeAll()
+        _pools.clear()
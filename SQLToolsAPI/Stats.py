@@ -0,0 +1,105 @@
+import time
+
+from collections import deque, OrderedDict
+from threading import Lock
+
+# number of most recent timings kept (of each kind)
+RING_SIZE = 200
+
+_timings = {}
+_lock = Lock()
+
+
+class Timing(object):
+    """Durations of the phases of single operation (query, completion, ...).
+
+    Each `mark` records the time elapsed since the previous mark (or since
+    the timing was created) as the duration of given phase.
+    """
+
+    def __init__(self, kind, name=''):
+        self.kind = kind
+        self.name = name
+        self.started = time.time()
+        self.phases = OrderedDict()
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0) + now - self.last
+        self.last = now
+
+    def total(self):
+        return sum(self.phases.values())
+
+    def finish(self):
+        record(self)
+
+
+def record(timing):
+    with _lock:
+        timings = _timings.get(timing.kind)
+        if timings is None:
+            timings = _timings[timing.kind] = deque(maxlen=RING_SIZE)
+        timings.append(timing)
+
+
+def recent(kind):
+    with _lock:
+        return list(_timings.get(kind, []))
+
+
+def clear():
+    with _lock:
+        _timings.clear()
+
+
+def summary():
+    """Return list of (kind, phase, count, average, max) of recent timings."""
+    with _lock:
+        kinds = sorted(_timings)
+        timings = {kind: list(_timings[kind]) for kind in kinds}
+
+    rows = []
+    for kind in kinds:
+        phases = OrderedDict()
+        for timing in timings[kind]:
+            for phase, duration in timing.phases.items():
+                phases.setdefault(phase, []).append(duration)
+        phases['total'] = [timing.total() for timing in timings[kind]]
+        for phase, durations in phases.items():
+            rows.append((kind, phase, len(durations),
+                         sum(durations) / len(durations), max(durations)))
+    return rows
+
+
+def formatStats(recentCount=10, caches=None):
+    """Format summary and recent timings, with hits and misses of `caches`
+    (dict of name and cache info, as returned by lru_cache's cache_info)."""
+    lines = ['{0:<12} {1:<14} {2:>6} {3:>12} {4:>12}'.format(
+        'kind', 'phase', 'count', 'avg (ms)', 'max (ms)')]
+    lines.append('-' * len(lines[0]))
+    for kind, phase, count, average, maximum in summary():
+        lines.append('{0:<12} {1:<14} {2:>6} {3:>12.3f} {4:>12.3f}'.format(
+            kind, phase, count, average * 1000, maximum * 1000))
+
+    if caches:
+        lines.append('')
+        lines.append('{0:<27} {1:>6} {2:>6} {3:>12}'.format('cache', 'hits', 'misses', 'size'))
+        for name, info in sorted(caches.items()):
+            lines.append('{0:<27} {1:>6} {2:>6} {3:>12}'.format(
+                name, info.hits, info.misses, '{0}/{1}'.format(info.currsize, info.maxsize)))
+
+    with _lock:
+        kinds = sorted(_timings)
+    for kind in kinds:
+        lines.append('')
+        lines.append('Recent {0}:'.format(kind))
+        for timing in recent(kind)[-recentCount:]:
+            phases = ', '.join('{0} {1:.1f} ms'.format(phase, duration * 1000)
+                               for phase, duration in timing.phases.items())
+            lines.append('  {0} {1} - {2}'.format(
+                time.strftime('%H:%M:%S', time.localtime(timing.started)),
+                timing.name, phases))
+
+    return '\n'.join(lines) + '\n'
@@ -1,7 +1,13 @@
 import os
+import re
+import copy
+import json
 import shutil
+import logging
 from . import Utils as U
 
+logger = logging.getLogger(__name__)
+
 __version__ = "v0.1.0"
 
 
@@ -10,6 +16,11 @@ class Storage:
         self.storageFile = filename
         self.defaultFile = default
         self.items = {}
+        self.defaultItems = {}
+
+        # merged items are parsed again only if one of the files changes
+        self.merged = None
+        self.signature = None
 
         # copy entire file, to keep comments
         # if not os.path.isfile(filename) and default and os.path.isfile(default):
@@ -18,6 +29,10 @@ class Storage:
         self.all()
 
     def all(self):
+        signature = self.filesSignature()
+        if self.merged is not None and signature == self.signature:
+            return self.merged
+
         userFile = self.getFilename()
 
         if os.path.exists(userFile):
@@ -25,10 +40,16 @@ class Storage:
         else:
             self.items = {}
 
-        return U.merge(self.items, self.defaults())
+        self.defaultItems = self.defaults()
+        self.merged = U.merge(self.items, copy.deepcopy(self.defaultItems))
+        self.signature = signature
+        return self.merged
 
     def write(self):
-        return U.saveJson(self.items if isinstance(self.items, dict) else {}, self.getFilename())
+        result = U.saveJson(self.items if isinstance(self.items, dict) else {}, self.getFilename())
+        # the cache was already updated by the caller
+        self.signature = self.filesSignature()
+        return result
 
     def add(self, key, value):
         if len(key) <= 0:
@@ -40,6 +61,7 @@ class Storage:
             value = [value]
 
         self.items[key] = '\n'.join(value)
+        self.merged[key] = self.items[key]
         self.write()
 
     def delete(self, key):
@@ -48,6 +70,10 @@ class Storage:
 
         self.all()
         self.items.pop(key)
+        if key in self.defaultItems:
+            self.merged[key] = copy.deepcopy(self.defaultItems[key])
+        else:
+            self.merged.pop(key, None)
         self.write()
 
     def get(self, key, default=None):
@@ -65,6 +91,82 @@ class Storage:
             return U.parseJson(self.defaultFile)
         return {}
 
+    def filesSignature(self):
+        return (self._fileSignature(self.getFilename()),
+                self._fileSignature(self.defaultFile))
+
+    @staticmethod
+    def _fileSignature(filename):
+        if not filename:
+            return None
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        return (stat.st_mtime, stat.st_size)
+
 
 class Settings(Storage):
     pass
+
+
+class MetadataCache:
+    """Cache of the database objects (tables, columns, functions, foreign keys)
+    per connection.
+
+    Each connection is saved in its own compact JSON file, together with the
+    fingerprint of connection, so the cached objects are served only for the
+    same database they were loaded from.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def getFilename(self, name):
+        safeName = re.sub(r'[^\w.-]', '_', name)
+        return os.path.join(self.directory, safeName + '.json')
+
+    def get(self, name, fingerprint):
+        filename = self.getFilename(name)
+        if not os.path.isfile(filename):
+            return None
+
+        try:
+            with open(filename, mode='r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            logger.info('failed to read cached objects of "%s"', name)
+            return None
+
+        # different connection names may share the same file name
+        if data.get('name') != name or data.get('fingerprint') != fingerprint:
+            return None
+        return data
+
+    def set(self, name, fingerprint, tables, columns, functions, foreignKeys=None):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        data = {
+            'name': name,
+            'fingerprint': fingerprint,
+            'tables': tables,
+            'columns': columns,
+            'functions': functions,
+            'foreign_keys': foreignKeys or []
+        }
+
+        # write to temporary file first, so readers never see partial file
+        filename = self.getFilename(name)
+        tmpFilename = filename + '.tmp'
+        try:
+            with open(tmpFilename, mode='w', encoding='utf-8') as outfile:
+                json.dump(data, outfile, separators=(',', ':'))
+            os.replace(tmpFilename, filename)
+        except OSError:
+            logger.info('failed to save cached objects of "%s"', name)
+
+    def delete(self, name):
+        filename = self.getFilename(name)
+        if os.path.isfile(filename):
+            os.remove(filename)
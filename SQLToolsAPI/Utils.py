@@ -9,18 +9,27 @@ dirpath = os.path.join(os.path.dirname(__file__), 'lib')
 if dirpath not in sys.path:
     sys.path.append(dirpath)
 
-import sqlparse
+# Regular expressions for comments, they can only match up to the end of
+# the comment, which avoids backtracking (e.g. to the end of a later comment)
+line_comment_pattern = r'//[^\n]*(?![^\n])'
+block_comment_pattern = r'/\*[^*]*\*+(?:[^/*][^*]*\*+)*/'
+# Regular expression for the parts of JSON file which need to be looked at
+# when removing comments and trailing commas. Strings are matched as well,
+# so that comment-like text in strings (e.g. "http://...") is left intact
+json_strip_re = re.compile(r'''
+    (?P<string>"(?:[^"\\]|\\.)*")
+    | {comment}
+    | ,(?=(?:\s|{comment})*[\]}}])
+'''.format(comment=line_comment_pattern + '|' + block_comment_pattern), re.VERBOSE)
 
-# Regular expression for comments
-comment_re = re.compile(
-    '(^)?[^\S\n]*/(?:\*(.*?)\*/[^\S\n]*|/[^\n]*)($)?',
-    re.DOTALL | re.MULTILINE
-)
+
+def _keepStrings(match):
+    return match.group('string') or ''
 
 
 def parseJson(filename):
     """ Parse a JSON file
-        First remove comments and then use the json module package
+        First remove comments and trailing commas and then use the json module package
         Comments look like :
             // ...
         or
@@ -30,21 +39,13 @@ def parseJson(filename):
     """
 
     with open(filename, mode='r', encoding='utf-8') as f:
-        content = ''.join(f.readlines())
-
-        # Looking for comments
-        match = comment_re.search(content)
-        while match:
-            # single line comment
-            content = content[:match.start()] + content[match.end():]
-            match = comment_re.search(content)
+        content = f.read()
 
-        # remove trailing commas
-        content = re.sub(r',([ \t\r\n]+)}', r'\1}', content)
-        content = re.sub(r',([ \t\r\n]+)\]', r'\1]', content)
+        # remove comments and trailing commas in single pass
+        content = json_strip_re.sub(_keepStrings, content)
 
         # Return json file
-        return json.loads(content, encoding='utf-8')
+        return json.loads(content)
 
 
 def saveJson(content, filename):
@@ -65,6 +66,9 @@ def getResultAsList(results):
 
 
 def formatSql(raw, settings):
+    # imported on first use, it takes a while to import
+    import sqlparse
+
     try:
         result = sqlparse.format(raw, **settings)
 
@@ -3,8 +3,12 @@ __version__ = "v0.3.0"
 
 __all__ = [
     'Utils',
+    'Stats',
     'Completion',
     'Command',
+    'Session',
+    'ResultSet',
+    'Pager',
     'Connection',
     'History',
     'Storage',
@@ -14,6 +14,7 @@ from sqlparse import engine
 from sqlparse import tokens
 from sqlparse import filters
 from sqlparse import formatter
+from sqlparse import lexer
 
 from sqlparse.compat import text_type
 
@@ -67,5 +68,20 @@ def split(sql, encoding=None):
     :param encoding: The encoding of the statement (optional).
     :returns: A list of strings.
     """
+    if isinstance(sql, text_type):
+        return [sql[start:end].strip() for start, end in splitoffsets(sql)]
+
     stack = engine.FilterStack()
     return [text_type(stmt).strip() for stmt in stack.run(sql, encoding)]
+
+
+def splitoffsets(sql):
+    """Split *sql* into single statements without parsing them.
+
+    :param sql: A string containing one or more SQL statements.
+    :returns: A generator of ``(start, end)`` offsets of the statements
+              (``sql[start:end]`` is the statement including surrounding
+              whitespace and comments, like :func:`split` before stripping).
+    """
+    stream = lexer.tokenize(sql)
+    return engine.StatementSplitter().process_offsets(stream)
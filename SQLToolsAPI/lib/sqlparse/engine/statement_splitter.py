@@ -103,3 +103,40 @@ class StatementSplitter(object):
         # Yield pending statement (if any)
         if self.tokens:
             yield sql.Statement(self.tokens)
+
+    def process_offsets(self, stream, inspect=None):
+        """Process the stream, yield (start, end) offsets of the statements
+
+        Same as process, but no tokens or statements are built, the offsets
+        are computed from the lengths of the token values.
+
+        If given, inspect(ttype, value) is called for each token, after the
+        offsets of the previous statement were yielded.
+        """
+        EOS_TTYPE = T.Whitespace, T.Comment.Single
+        Keyword = T.Keyword
+        Punctuation = T.Punctuation
+        self._reset()
+
+        start = pos = 0
+        has_tokens = False
+        for ttype, value in stream:
+            if self.consume_ws and ttype not in EOS_TTYPE:
+                yield start, pos
+                self._reset()
+                start = pos
+
+            if ttype in Keyword:
+                self.level += self._change_splitlevel(ttype, value)
+
+            if inspect is not None:
+                inspect(ttype, value)
+
+            has_tokens = True
+            pos += len(value)
+
+            if self.level <= 0 and ttype is Punctuation and value == ';':
+                self.consume_ws = True
+
+        if has_tokens:
+            yield start, pos
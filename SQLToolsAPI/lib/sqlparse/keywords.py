@@ -85,6 +85,51 @@ SQL_REGEX = {
     ]}
 
 FLAGS = re.IGNORECASE | re.UNICODE
+
+
+def _shift_backreferences(regex, offset):
+    """Renumber backreferences (e.g. ``\\1``) of `regex` by `offset`."""
+    result = []
+    i = 0
+    while i < len(regex):
+        char = regex[i]
+        if char == '\\' and i + 1 < len(regex):
+            j = i + 1
+            while j < len(regex) and regex[j].isdigit():
+                j += 1
+            if j > i + 1:
+                result.append('\\{0}'.format(int(regex[i + 1:j]) + offset))
+            else:
+                j = i + 2
+                result.append(regex[i:j])
+            i = j
+        else:
+            result.append(char)
+            i += 1
+    return ''.join(result)
+
+
+def _build_master_regex(regexes):
+    """Join all the regular expressions into a single alternation.
+
+    Alternatives are tried from left to right and the first one that matches
+    wins, which is exactly what trying each regular expression in turn does.
+    Every alternative is wrapped in a named group (its index), so the action
+    of the matched alternative is looked up by ``match.lastgroup``.
+    """
+    parts = []
+    actions = {}
+    groups = 0
+    for index, (rx, tt) in enumerate(regexes):
+        name = 'g{0}'.format(index)
+        parts.append('(?P<{0}>{1})'.format(
+            name, _shift_backreferences(rx, groups + 1)))
+        actions[name] = tt
+        groups += re.compile(rx, FLAGS).groups + 1
+    return re.compile('|'.join(parts), FLAGS).match, actions
+
+
+SQL_REGEX_MASTER, SQL_REGEX_ACTIONS = _build_master_regex(SQL_REGEX['root'])
 SQL_REGEX = [(re.compile(rx, FLAGS).match, tt) for rx, tt in SQL_REGEX['root']]
 
 KEYWORDS = {
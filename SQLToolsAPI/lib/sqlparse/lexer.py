@@ -13,9 +13,8 @@
 # and to allow some customizations.
 
 from sqlparse import tokens
-from sqlparse.keywords import SQL_REGEX
+from sqlparse.keywords import SQL_REGEX_MASTER, SQL_REGEX_ACTIONS
 from sqlparse.compat import bytes_type, text_type, file_types
-from sqlparse.utils import consume
 
 
 class Lexer(object):
@@ -54,22 +53,25 @@ class Lexer(object):
             raise TypeError(u"Expected text or file-like object, got {!r}".
                             format(type(text)))
 
-        iterable = enumerate(text)
-        for pos, char in iterable:
-            for rexmatch, action in SQL_REGEX:
-                m = rexmatch(text, pos)
-
-                if not m:
-                    continue
-                elif isinstance(action, tokens._TokenType):
-                    yield action, m.group()
-                elif callable(action):
-                    yield action(m.group())
-
-                consume(iterable, m.end() - pos - 1)
-                break
-            else:
-                yield tokens.Error, char
+        # all the regular expressions are tried at once by a single master
+        # regex, instead of trying them one after another at each position
+        pos = 0
+        end = len(text)
+        while pos < end:
+            m = SQL_REGEX_MASTER(text, pos)
+
+            if not m:
+                yield tokens.Error, text[pos]
+                pos += 1
+                continue
+
+            action = SQL_REGEX_ACTIONS[m.lastgroup]
+            if isinstance(action, tokens._TokenType):
+                yield action, m.group()
+            elif callable(action):
+                yield action(m.group())
+
+            pos = m.end()
 
 
 def tokenize(sql, encoding=None):
@@ -0,0 +1,21 @@
+"""Fake DB CLI for benchmarks: reads the query from stdin and prints a table.
+
+Usage: fake_cli.py [rows]
+"""
+import sys
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    sys.stdin.read()
+
+    out = sys.stdout
+    out.write(' id | name       | value\n')
+    out.write('----+------------+-------\n')
+    for i in range(rows):
+        out.write(' {0:>2} | name_{0:<5} | {1:>5}\n'.format(i, i * 7 % 1000))
+    out.write('({0} rows)\n\n'.format(rows))
+
+
+if __name__ == '__main__':
+    main()
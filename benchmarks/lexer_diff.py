@@ -0,0 +1,99 @@
+"""Differential test of the sqlparse lexer against its previous implementation.
+
+The vendored lexer tries all the regular expressions at once with a single
+master regex. The previous implementation (trying the regular expressions one
+after another at each position) is kept here as reference, both must produce
+the same tokens.
+
+Usage:
+    python benchmarks/lexer_diff.py [--cases N] [--seed N]
+"""
+import argparse
+import os
+import random
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'SQLToolsAPI', 'lib'))
+
+from sqlparse import lexer, tokens  # noqa: E402
+from sqlparse.keywords import SQL_REGEX  # noqa: E402
+from sqlparse.utils import consume  # noqa: E402
+
+# pieces the random scripts are built of, chosen to hit most of the patterns
+FRAGMENTS = [
+    'SELECT', 'select', 'FROM', 'WHERE', 'GROUP BY', 'ORDER  BY', 'LEFT OUTER JOIN',
+    'CREATE OR REPLACE', 'END IF', 'NOT NULL', 'UNION ALL', 'DOUBLE PRECISION',
+    ' ', '  ', '\t', '\n', '\r\n', '\r', ';', ',', '.', '(', ')', '[', ']', '*', '::',
+    ':=', '=>', '<>', '!=', '>=', '<=', '||', '+', '-', '/', '%', '^', '~', '&', '|',
+    'foo', 'bar_1', '"quoted ""name"""', '`backtick`', '[bracket name]', 'a.b', 'x.*',
+    '1', '1.5', '.5', '1e10', '-3.2E-4', '0x1F', "'str'", "'it''s'", "E'esc\\'aped'",
+    "N'unicode'", '$$body$$', '$tag$ body $tag$', ':name', '?', '%s', '%(name)s', '$1',
+    '@var', '@@global', '#temp', '-- comment\n', '--\n', '# hash comment\n', '--+ hint\n',
+    '/* multi\nline */', '/*+ hint */', 'count(*)', 'max(x)', 'CASE WHEN x THEN 1 END',
+    'BEGIN', 'DECLARE', 'IF', 'FOR', 'WHILE', 'LIMIT 10', 'ä', ' ', '\\', '{', '}',
+]
+
+
+def referenceTokenize(text):
+    """Previous implementation of Lexer.get_tokens (for text input)."""
+    iterable = enumerate(text)
+    for pos, char in iterable:
+        for rexmatch, action in SQL_REGEX:
+            m = rexmatch(text, pos)
+
+            if not m:
+                continue
+            elif isinstance(action, tokens._TokenType):
+                yield action, m.group()
+            elif callable(action):
+                yield action(m.group())
+
+            consume(iterable, m.end() - pos - 1)
+            break
+        else:
+            yield tokens.Error, char
+
+
+def randomScript(rand):
+    return ''.join(rand.choice(FRAGMENTS) + rand.choice(['', ' ', '\n'])
+                   for i in range(rand.randint(0, 40)))
+
+
+def firstDifference(text):
+    expected = list(referenceTokenize(text))
+    actual = list(lexer.tokenize(text))
+    if expected == actual:
+        return None
+    for index, (a, b) in enumerate(zip(expected, actual)):
+        if a != b:
+            return index, a, b
+    index = min(len(expected), len(actual))
+    return index, expected[index:index + 1], actual[index:index + 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Differential test of the sqlparse lexer')
+    parser.add_argument('--cases', type=int, default=20000, help='number of random scripts')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random scripts')
+    args = parser.parse_args()
+
+    rand = random.Random(args.seed)
+    texts = FRAGMENTS + [randomScript(rand) for i in range(args.cases)]
+
+    failures = 0
+    for text in texts:
+        difference = firstDifference(text)
+        if difference is not None:
+            failures += 1
+            if failures <= 10:
+                print('token {0} differs for {1!r}: expected {2!r}, got {3!r}'.format(
+                    difference[0], text, difference[1], difference[2]))
+
+    print('{0} of {1} texts differ'.format(failures, len(texts)))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""Benchmarks of the SQLToolsAPI hot paths, runs without Sublime Text.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--quick] [--only NAME ...]
+                                        [--output FILE] [--compare FILE]
+
+Results (best and median time of each benchmark, in seconds) are written as
+JSON to --output, so they can be compared between commits with --compare.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'SQLToolsAPI', 'lib'))
+
+from SQLToolsAPI import Utils, ParseUtils  # noqa: E402
+from SQLToolsAPI.Completion import Completion  # noqa: E402
+from SQLToolsAPI.Command import Command  # noqa: E402
+
+import sqlparse  # noqa: E402
+from sqlparse import lexer  # noqa: E402
+
+from lexer_diff import referenceTokenize  # noqa: E402
+
+FAKE_CLI = os.path.join(BENCH_DIR, 'fake_cli.py')
+
+COMPLETION_SIZES = [1000, 10000, 100000, 1000000]
+QUICK_COMPLETION_SIZES = [1000, 10000]
+
+QUERIES = [
+    "SELECT u.id, u.name, o.total FROM users u JOIN orders o ON o.user_id = u.id WHERE o.total > 10",
+    "select * from public.accounts a left join public.transactions t on t.account_id = a.id",
+    "SELECT count(*) FROM (SELECT customer_id FROM sales.invoices GROUP BY customer_id) sub",
+    "UPDATE products SET price = price * 1.1 WHERE category_id IN (SELECT id FROM categories)",
+    "INSERT INTO audit_log (user_id, action) SELECT id, 'login' FROM users WHERE active = 1",
+    "with recent as (select * from events where created_at > now() - interval '1 day') "
+    "select e.type, count(*) from recent e join event_types et on et.id = e.type_id group by e.type",
+]
+
+FORMAT_SETTINGS = {
+    'keyword_case': 'upper',
+    'identifier_case': None,
+    'strip_comments': False,
+    'indent_tabs': False,
+    'indent_width': 4,
+    'reindent': True
+}
+
+
+def timeit(fn, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {
+        'best': times[0],
+        'median': times[len(times) // 2],
+        'repeat': repeat
+    }
+
+
+def syntheticSchema(columnCount):
+    random.seed(columnCount)
+    columnsPerTable = 20
+    tableCount = max(1, columnCount // columnsPerTable)
+    tables = ['table_{0}'.format(i) for i in range(tableCount)]
+    columns = ['{0}.column_{1}'.format(tables[i % tableCount], i // tableCount)
+               for i in range(columnCount)]
+    functions = ['function_{0}'.format(i) for i in range(max(10, tableCount // 10))]
+    return tables, columns, functions
+
+
+def benchCompletion(sizes, repeat):
+    results = {}
+    for size in sizes:
+        tables, columns, functions = syntheticSchema(size)
+        completion = [None]
+
+        def build():
+            completion[0] = Completion(tables, columns, functions)
+
+        results['completion_build_{0}'.format(size)] = timeit(build, max(1, repeat // 5))
+
+        sql = 'SELECT t.column_1 FROM table_1 t JOIN table_2 x ON x.column_2 = t.column_3 WHERE '
+        lookups = [('col', sql + 'col'), ('t.', sql + 't.'), ('x.column_1', sql + 'x.column_1'),
+                   ('tab', 'SELECT * FROM tab'), ('f', sql + 'f')]
+
+        def complete():
+            for prefix, sqlToCursor in lookups:
+                completion[0].getAutoCompleteList(prefix, sqlToCursor, sqlToCursor)
+
+        results['completion_lookup_{0}'.format(size)] = timeit(complete, repeat)
+    return results
+
+
+def benchExtractTables(repeat):
+    def extract():
+        for query in QUERIES:
+            ParseUtils.extractTables(query)
+
+    return {'extract_tables': timeit(extract, repeat)}
+
+
+def largeScript(statements):
+    parts = []
+    for i in range(statements):
+        parts.append(QUERIES[i % len(QUERIES)] + ';\n')
+        if i % 10 == 0:
+            parts.append('-- comment {0}\n'.format(i))
+    return ''.join(parts)
+
+
+def benchSqlparse(statements, repeat):
+    script = largeScript(statements)
+    return {
+        'format_sql': timeit(lambda: Utils.formatSql(script[:len(script) // 10], FORMAT_SETTINGS), repeat),
+        'sqlparse_split': timeit(lambda: sqlparse.split(script), repeat),
+        'split_statements': timeit(lambda: ParseUtils._splitStatements(script), repeat),
+    }
+
+
+def benchLexer(statements, repeat):
+    # previous implementation of the lexer, for comparison
+    script = largeScript(statements)
+    return {
+        'lexer': timeit(lambda: list(lexer.tokenize(script)), repeat),
+        'lexer_reference': timeit(lambda: list(referenceTokenize(script)), repeat),
+    }
+
+
+# previous implementation of Utils.parseJson, for comparison (it strips
+# comments one at a time, does not skip strings, e.g. "http://...", and
+# removes only trailing commas followed by whitespace)
+REFERENCE_COMMENT_RE = re.compile(
+    r'(^)?[^\S\n]*/(?:\*(.*?)\*/[^\S\n]*|/[^\n]*)($)?',
+    re.DOTALL | re.MULTILINE
+)
+
+
+def referenceParseJson(filename):
+    with open(filename, mode='r', encoding='utf-8') as f:
+        content = ''.join(f.readlines())
+
+        match = REFERENCE_COMMENT_RE.search(content)
+        while match:
+            content = content[:match.start()] + content[match.end():]
+            match = REFERENCE_COMMENT_RE.search(content)
+
+        content = re.sub(r',([ \t\r\n]+)}', r'\1}', content)
+        content = re.sub(r',([ \t\r\n]+)\]', r'\1]', content)
+
+        return json.loads(content)
+
+
+def settingsFile(entries, compatible=False):
+    # compatible settings can be parsed by the previous implementation too
+    entry = ('    "connection_{0}": {{"type": "pgsql", "host": "db{0}.example.com", '
+             '"url": "http://example.com/{0}", "port": {0}, /* inline */ "options": [1, 2, 3,],}},')
+    if compatible:
+        entry = ('    "connection_{0}": {{"type": "pgsql", "host": "db{0}.example.com", '
+                 '"port": {0}, /* inline */ "options": [1, 2, 3, ], }},')
+
+    lines = ['// generated settings file', '{']
+    for i in range(entries):
+        lines.append('    // connection {0}'.format(i))
+        lines.append(entry.format(i))
+    lines.append('}')
+
+    handle, filename = tempfile.mkstemp(suffix='.sublime-settings')
+    with os.fdopen(handle, 'w') as f:
+        f.write('\n'.join(lines))
+    return filename
+
+
+def benchParseJson(entries, repeat):
+    filename = settingsFile(entries)
+    # previous implementation is quadratic, it gets a smaller file
+    plainFilename = settingsFile(entries // 10, compatible=True)
+    try:
+        if Utils.parseJson(plainFilename) != referenceParseJson(plainFilename):
+            raise AssertionError('parseJson differs from the previous implementation')
+        return {
+            'parse_json': timeit(lambda: Utils.parseJson(filename), repeat),
+            'parse_json_small': timeit(lambda: Utils.parseJson(plainFilename), repeat),
+            'parse_json_reference': timeit(lambda: referenceParseJson(plainFilename), repeat),
+        }
+    finally:
+        os.remove(filename)
+        os.remove(plainFilename)
+
+
+def benchCommand(repeat):
+    def run(rows):
+        Command.createAndRun(args=[sys.executable, FAKE_CLI, str(rows)],
+                             env={},
+                             callback=lambda result: None,
+                             query='select 1;',
+                             timeout=60)
+
+    return {
+        'command_spawn': timeit(lambda: run(10), repeat),
+        'command_large_output': timeit(lambda: run(100000), max(1, repeat // 5)),
+    }
+
+
+# imports of the plugin, timed in fresh interpreter (modules of standard
+# library, which Sublime Text has loaded already, are imported beforehand)
+STARTUP_SCRIPT = '''
+import sys, time
+import json, re, logging, subprocess, shutil, codecs, concurrent.futures
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+from SQLToolsAPI import Utils, ParseUtils, Completion, Connection
+imported = time.perf_counter()
+ParseUtils.splitStatements('select 1')
+firstUse = time.perf_counter()
+print(imported - start, firstUse - imported)
+'''
+
+
+def benchStartup(repeat):
+    script = STARTUP_SCRIPT.format(root=ROOT_DIR)
+    imports = []
+    firstUses = []
+    for i in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', script])
+        imported, firstUse = map(float, output.split())
+        imports.append(imported)
+        firstUses.append(firstUse)
+
+    def result(times):
+        times.sort()
+        return {'best': times[0], 'median': times[len(times) // 2], 'repeat': repeat}
+
+    return {
+        'startup_import': result(imports),
+        'startup_first_split': result(firstUses),
+    }
+
+
+BENCHMARKS = {
+    'completion': lambda args: benchCompletion(
+        QUICK_COMPLETION_SIZES if args.quick else COMPLETION_SIZES, args.repeat),
+    'extract_tables': lambda args: benchExtractTables(args.repeat * 10),
+    'sqlparse': lambda args: benchSqlparse(500 if args.quick else 5000, args.repeat),
+    'lexer': lambda args: benchLexer(500 if args.quick else 5000, args.repeat),
+    'parse_json': lambda args: benchParseJson(500 if args.quick else 5000, args.repeat),
+    'command': lambda args: benchCommand(args.repeat),
+    'startup': lambda args: benchStartup(args.repeat * 2),
+}
+
+
+def gitRevision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(results, previousFile):
+    with open(previousFile) as f:
+        previous = json.load(f)['results']
+
+    print('\n{0:<32} {1:>12} {2:>12} {3:>8}'.format('benchmark', 'previous', 'current', 'ratio'))
+    for name, result in sorted(results.items()):
+        if name not in previous:
+            continue
+        before = previous[name]['best']
+        after = result['best']
+        print('{0:<32} {1:>12.6f} {2:>12.6f} {3:>7.2f}x'.format(
+            name, before, after, after / before if before else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the SQLToolsAPI hot paths')
+    parser.add_argument('--quick', action='store_true', help='smaller inputs')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs of each benchmark')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='benchmarks to run')
+    parser.add_argument('--output', help='file to write the results (JSON) to')
+    parser.add_argument('--compare', help='results (JSON) of previous run to compare with')
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.only or sorted(BENCHMARKS):
+        for benchmark, result in sorted(BENCHMARKS[name](args).items()):
+            print('{0:<32} best {1:.6f} s, median {2:.6f} s'.format(
+                benchmark, result['best'], result['median']))
+            results[benchmark] = result
+
+    report = {
+        'revision': gitRevision(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'quick': args.quick,
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
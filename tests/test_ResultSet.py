@@ -0,0 +1,52 @@
+"""Tests of parsing of DB CLI table output, run with:
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SQLToolsAPI.ResultSet import parseResult  # noqa: E402
+
+
+def parsed(text, style):
+    return [(resultSet.columns, list(resultSet.rows())) for resultSet in parseResult(text, style)]
+
+
+class MysqlTest(unittest.TestCase):
+    def testTable(self):
+        text = ('+----+------+\n'
+                '| id | name |\n'
+                '+----+------+\n'
+                '|  1 | a    |\n'
+                '|  2 | b    |\n'
+                '+----+------+\n'
+                '2 rows in set (0.00 sec)\n')
+        self.assertEqual(parsed(text, 'mysql'),
+                         [(['id', 'name'], [('1', 'a'), ('2', 'b')])])
+
+    def testEmptyTableFollowedByTable(self):
+        text = ('+----+------+\n'
+                '| id | name |\n'
+                '+----+------+\n'
+                '+----+------+\n'
+                '+-------+\n'
+                '| total |\n'
+                '+-------+\n'
+                '|    10 |\n'
+                '+-------+\n'
+                '1 row in set (0.00 sec)\n')
+        self.assertEqual(parsed(text, 'mysql'),
+                         [(['id', 'name'], []), (['total'], [('10',)])])
+
+
+class PsqlTest(unittest.TestCase):
+    def testRowsWithEmptyValues(self):
+        text = ' x \n---\n \n a\n(2 rows)\n\n'
+        self.assertEqual(parsed(text, 'psql'), [(['x'], [('',), ('a',)])])
+
+
+if __name__ == '__main__':
+    unittest.main()